@@ -1,19 +1,46 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 import os
 from dotenv import load_dotenv
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.local import LocalProxy
+from werkzeug.security import generate_password_hash
 import jwt
+import calendar
+import queue
+import threading
+import time
 import datetime
+import uuid
+import itertools
 from bson import ObjectId
+from bson.errors import InvalidId
+from services.cache import TTLCache, SingleFlight
+from services.revocation import RevocationList
+from services.write_buffer import WriteBuffer
+from services.counters import AttendanceCounters
+from services.rollups import AttendanceRollups
+from services.export import AttendanceExport
+from services.indexes import application_indexes
+from services.analytics import HEATMAP_GROUPS, AnalyticsUnavailable, DepartmentAnalytics
+from services.catalog import ACCOUNTS_ID, SubjectCatalog, VersionWatch, bump_catalog_version
+from services.events import EventBroker, ChangeStreamRelay, ScanCountPairing, format_sse
+from services.streaming import (
+    STREAM_BATCH_SIZE, InvalidCursor, KeysetPage, decode_cursor, parse_limit, stream_json_response
+)
+from services.qr_tokens import sign_qr_token, verify_qr_token, InvalidQRCode, ExpiredQRCode, ClosedSessionList
+from services.passwords import PASSWORD_HASH_METHOD, HashPoolBusy, hash_pool, hash_password, verify_password, needs_rehash
+from services.request_timing import RequestTiming
+from services.metrics import MetricsRegistry, MongoCommandMetrics, RequestMetrics
+from services.log import configure_logging, init_request_ids, log_event, parse_event_rates
+import logging
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
+# API routes; the Flask app itself is built by create_app()
+api = Blueprint('api', __name__)
 
 # MongoDB Atlas connection string - handle case-sensitivity
 MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/attendmax')
@@ -21,224 +48,702 @@ MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/attendmax')
 if '/attendmax' in MONGO_URI:
     MONGO_URI = MONGO_URI.replace('/attendmax', '/Attendmax')
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'default_secret_key')
+TOKEN_LIFETIME = datetime.timedelta(days=1)
+# Key for signing QR payloads; defaults to the JWT secret
+QR_SECRET_KEY = os.environ.get('QR_SECRET_KEY', JWT_SECRET_KEY)
+# A class session spans one lecture; QR codes rotate within it without new documents
+QR_VALID_SECONDS = 15
+CLASS_SESSION_MINUTES = int(os.environ.get('CLASS_SESSION_MINUTES', 120))
+# Expired sessions are removed by a TTL index after this many seconds
+CLASS_SESSION_RETENTION_SECONDS = int(os.environ.get('CLASS_SESSION_RETENTION_SECONDS', 86400))
+# Only bootstrap builds indexes; each worker compares them with the registry on its first request
+INDEX_CHECK_ON_START = os.environ.get('INDEX_CHECK_ON_START', 'True').lower() in ('true', '1', 't')
 
-try:
-    # Configure MongoDB with Atlas connection string
-    client = MongoClient(MONGO_URI)
-    db = client.Attendmax  # Use explicit database name with correct case
-    
-    # Define collections
-    users = db['users']
-    students = db['students']
-    teachers = db['teachers']
-    departments = db['departments']
-    subjects = db['subjects']
-    attendance_records = db['attendance_records']
-    qr_codes = db['qr_codes']
-
-    # Test the connection
-    client.server_info()
-    print("Successfully connected to MongoDB Atlas")
-
-    # Create indexes
-    users.create_index('email', unique=True)
-    users.create_index('username', unique=True)
-    students.create_index('prn', unique=True)
-    students.create_index('email', unique=True)
-    teachers.create_index('email', unique=True)
-    departments.create_index('code', unique=True)
-    subjects.create_index([('code', 1), ('department', 1)], unique=True)
-    
-    # Function to initialize sample data
-    def initialize_sample_data():
-        # Initialize departments if they don't exist
-        if departments.count_documents({}) == 0:
-            sample_departments = [
-                {'name': 'Computer Science', 'code': 'CS'},
-                {'name': 'Information Technology', 'code': 'IT'},
-                {'name': 'Electronics', 'code': 'EC'},
-                {'name': 'Mechanical Engineering', 'code': 'ME'}
-            ]
-            departments.insert_many(sample_departments)
-            print("Sample departments created")
-        
-        # Initialize subjects if they don't exist
-        if subjects.count_documents({}) == 0:
-            sample_subjects = [
-                {'name': 'Data Structures', 'code': 'CS101', 'department': 'CS', 'year': 2, 'credits': 4},
-                {'name': 'Algorithms', 'code': 'CS201', 'department': 'CS', 'year': 2, 'credits': 4},
-                {'name': 'Database Systems', 'code': 'CS301', 'department': 'CS', 'year': 3, 'credits': 3},
-                {'name': 'Web Development', 'code': 'IT101', 'department': 'IT', 'year': 2, 'credits': 3},
-                {'name': 'Network Security', 'code': 'IT201', 'department': 'IT', 'year': 3, 'credits': 3},
-                {'name': 'Digital Electronics', 'code': 'EC101', 'department': 'EC', 'year': 2, 'credits': 4},
-                {'name': 'Thermodynamics', 'code': 'ME101', 'department': 'ME', 'year': 2, 'credits': 4}
-            ]
-            subjects.insert_many(sample_subjects)
-            print("Sample subjects created")
-
-    # Create admin user if it doesn't exist
-    def create_admin_user():
-        admin = users.find_one({'email': 'admin@attendmax.com'})
-        if not admin:
-            admin_user = {
-                'username': 'admin',
-                'email': 'admin@attendmax.com',
-                'password': generate_password_hash('admin123'),
-                'role': 'admin',
-                'registered_ip': '127.0.0.1',
+# Stateless mode trusts the signed token claims and never reads the users collection
+STATELESS_AUTH = os.environ.get('STATELESS_AUTH', 'False').lower() in ('true', '1', 't')
+REVOCATION_REFRESH_SECONDS = int(os.environ.get('REVOCATION_REFRESH_SECONDS', 30))
+
+# Verified users are cached in-process so authenticated requests skip the users lookup
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# Only the fields request handlers need; the password hash never enters the cache
+USER_CACHE_PROJECTION = {'username': 1, 'email': 1, 'role': 1, 'registered_ip': 1}
+
+# Hot-path lookups for mark_attendance: student profiles, QR codes, subjects, enrollment
+PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 300))
+student_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=PROFILE_CACHE_TTL)
+teacher_cache = TTLCache(maxsize=1000, ttl=PROFILE_CACHE_TTL)
+class_session_cache = TTLCache(maxsize=1000, ttl=CLASS_SESSION_MINUTES * 60)
+enrollment_cache = TTLCache(maxsize=1000, ttl=PROFILE_CACHE_TTL)
+roster_cache = TTLCache(maxsize=1000, ttl=PROFILE_CACHE_TTL)
+# Largest roster a teacher can mark in one bulk request
+MAX_BULK_ATTENDANCE = int(os.environ.get('MAX_BULK_ATTENDANCE', 1000))
+# Offline scans are uploaded in batches: the largest batch, how long after a scan it may
+# still be uploaded, and how far a device clock may run ahead of the server
+MAX_SYNC_SCANS = int(os.environ.get('MAX_SYNC_SCANS', 200))
+SYNC_MAX_AGE_SECONDS = int(os.environ.get('SYNC_MAX_AGE_SECONDS', 86400))
+SYNC_CLOCK_SKEW_SECONDS = int(os.environ.get('SYNC_CLOCK_SKEW_SECONDS', 30))
+# Attendance exports read students in chunks and records in cursor batches of these sizes
+EXPORT_CHUNK_STUDENTS = int(os.environ.get('EXPORT_CHUNK_STUDENTS', 500))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+# Department presence matrices are cached per date range and rebuilt when attendance changes
+ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', 600))
+ANALYTICS_CACHE_SIZE = int(os.environ.get('ANALYTICS_CACHE_SIZE', 32))
+DEFAULTER_THRESHOLD = float(os.environ.get('DEFAULTER_THRESHOLD', 75))
+PRESENT_COUNT_TTL = int(os.environ.get('PRESENT_COUNT_TTL', 5))
+# Teacher dashboards poll class status; results are shared for a few seconds
+STATUS_CACHE_TTL = int(os.environ.get('STATUS_CACHE_TTL', 3))
+attendance_status_cache = TTLCache(maxsize=1000, ttl=STATUS_CACHE_TTL)
+attendance_status_flight = SingleFlight()
+# Bumped whenever a class's status changes, so a computation that started earlier is not cached
+attendance_status_generations = TTLCache(maxsize=1000, ttl=3600)
+attendance_status_generation_counter = itertools.count(1)
+# Live scan feed for the teacher's class screen. With several worker processes, enable
+# the change stream relay (replica set required) so every worker sees every scan.
+SSE_CHANGE_STREAM = os.environ.get('SSE_CHANGE_STREAM', 'False').lower() in ('true', '1', 't')
+SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+# How often each worker checks whether the subject catalog changed
+CATALOG_CHECK_SECONDS = int(os.environ.get('CATALOG_CHECK_SECONDS', 10))
+# Most MongoDB commands one request may issue, measured on each endpoint's longest path
+# with cold caches and every periodic refresh due; a request that goes over points at an
+# N+1 pattern. DB_BUDGET_MODE is off, log or raise (for tests).
+DB_BUDGET_MODE = os.environ.get('DB_BUDGET_MODE', 'log').lower()
+DB_ROUND_TRIP_BUDGETS = {
+    # User lookup, hash upgrade, teacher lookup and a missing teacher record's insert
+    'api.login': 4,
+    'api.get_students': 5,
+    'api.get_student_profile': 4,
+    'api.get_teacher_profile': 4,
+    'api.get_subjects': 5,
+    'api.generate_qr_code': 10,
+    'api.close_qr_code': 8,
+    'api.mark_attendance': 11,
+    'api.bulk_mark_attendance': 11,
+    'api.sync_attendance': 13,
+    'api.get_attendance_data': 10,
+    'api.get_attendance_status': 5,
+    'api.export_attendance': 3,
+}
+request_timing = RequestTiming(DB_ROUND_TRIP_BUDGETS, DB_BUDGET_MODE)
+# Structured JSON logs go to stdout from a background thread. Noisy events are sampled
+# (fraction kept) or capped per second per worker; LOG_SAMPLE_RATES / LOG_RATE_LIMITS
+# take 'event=value,...' overrides.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_RATES = {
+    'login_attempt': 0.1,
+    'login_succeeded': 0.1,
+    **parse_event_rates(os.environ.get('LOG_SAMPLE_RATES'))
+}
+LOG_RATE_LIMITS = {
+    'login_failed': 20,
+    'login_ip_changed': 10,
+    'mark_attendance_failed': 20,
+    'db_budget_exceeded': 5,
+    **parse_event_rates(os.environ.get('LOG_RATE_LIMITS'), int)
+}
+
+# Prometheus metrics for /metrics. With several worker processes, point METRICS_DIR
+# at a directory they share (cleared on restart) so any worker reports the whole server.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+metrics = MetricsRegistry(METRICS_DIR)
+request_metrics = RequestMetrics(metrics)
+mongo_metrics = MongoCommandMetrics(metrics)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return this process's MongoClient, creating it on first use"""
+    global _client, _client_pid
+    # Nothing that holds sockets or threads survives a fork: this client, the hash pool,
+    # write buffers, log writer and metrics flusher are each created on first use in every
+    # server worker, keyed on os.getpid()
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            # Configure MongoDB with Atlas connection string
+            _client = MongoClient(MONGO_URI, event_listeners=[request_timing.listener, mongo_metrics])
+            _client_pid = os.getpid()
+        return _client
+
+def get_db():
+    return get_client().Attendmax  # Use explicit database name with correct case
+
+def _lazy_collection(name):
+    return LocalProxy(lambda: get_db()[name])
+
+# Define collections; nothing connects until a request or command first uses one
+db = LocalProxy(get_db)
+users = _lazy_collection('users')
+students = _lazy_collection('students')
+teachers = _lazy_collection('teachers')
+departments = _lazy_collection('departments')
+subjects = _lazy_collection('subjects')
+attendance_records = _lazy_collection('attendance_records')
+revoked_tokens = _lazy_collection('revoked_tokens')
+attendance_counters = _lazy_collection('attendance_counters')
+class_sessions = _lazy_collection('class_sessions')
+catalog_meta = _lazy_collection('catalog_meta')
+attendance_rollups = _lazy_collection('attendance_rollups')
+subject_catalog = SubjectCatalog(subjects, catalog_meta, check_seconds=CATALOG_CHECK_SECONDS)
+# Every index the app relies on (see scripts/sync_indexes.py)
+index_registry = application_indexes(CLASS_SESSION_RETENTION_SECONDS)
+
+def create_indexes(drop_extra=False):
+    """Bring indexes in line with the registry, building only what is missing"""
+    report = index_registry.sync(get_db(), drop_extra=drop_extra)
+    for line in report.lines() or ['up to date']:
+        print(f"Indexes: {line}")
+    return report
+
+index_check_started = threading.Lock()
+
+def report_index_drift():
+    """Log how the database's indexes differ from the registry, without changing them"""
+    try:
+        report = index_registry.check(get_db())
+    except PyMongoError as e:
+        log_event('index_check_failed', logging.WARNING, error=str(e))
+        return
+    if not report.in_sync:
+        log_event('index_drift', logging.WARNING, differences=report.lines())
+
+def initialize_sample_data():
+    # Initialize departments if they don't exist
+    if departments.count_documents({}) == 0:
+        sample_departments = [
+            {'name': 'Computer Science', 'code': 'CS'},
+            {'name': 'Information Technology', 'code': 'IT'},
+            {'name': 'Electronics', 'code': 'EC'},
+            {'name': 'Mechanical Engineering', 'code': 'ME'}
+        ]
+        departments.insert_many(sample_departments)
+        print("Sample departments created")
+
+    # Initialize subjects if they don't exist
+    if subjects.count_documents({}) == 0:
+        sample_subjects = [
+            {'name': 'Data Structures', 'code': 'CS101', 'department': 'CS', 'year': 2, 'credits': 4},
+            {'name': 'Algorithms', 'code': 'CS201', 'department': 'CS', 'year': 2, 'credits': 4},
+            {'name': 'Database Systems', 'code': 'CS301', 'department': 'CS', 'year': 3, 'credits': 3},
+            {'name': 'Web Development', 'code': 'IT101', 'department': 'IT', 'year': 2, 'credits': 3},
+            {'name': 'Network Security', 'code': 'IT201', 'department': 'IT', 'year': 3, 'credits': 3},
+            {'name': 'Digital Electronics', 'code': 'EC101', 'department': 'EC', 'year': 2, 'credits': 4},
+            {'name': 'Thermodynamics', 'code': 'ME101', 'department': 'ME', 'year': 2, 'credits': 4}
+        ]
+        subjects.insert_many(sample_subjects)
+        bump_catalog_version(catalog_meta)
+        print("Sample subjects created")
+
+# Create admin user if it doesn't exist
+def create_admin_user():
+    admin = users.find_one({'email': 'admin@attendmax.com'})
+    if not admin:
+        admin_user = {
+            'username': 'admin',
+            'email': 'admin@attendmax.com',
+            'password': generate_password_hash('admin123', PASSWORD_HASH_METHOD),
+            'role': 'admin',
+            'registered_ip': '127.0.0.1',
+            'created_at': datetime.datetime.utcnow()
+        }
+        users.insert_one(admin_user)
+        print("Admin user created successfully")
+    else:
+        print("Admin user already exists")
+
+# Create example student accounts
+def create_student_accounts():
+    # Sample student data
+    sample_students = [
+        {
+            'name': 'John Smith',
+            'prn': 'CS2001',
+            'email': 'student1@example.com',
+            'department': 'CS',
+            'year': 2,
+            'subjects': ['CS101', 'CS201']
+        },
+        {
+            'name': 'Sarah Johnson',
+            'prn': 'CS2002',
+            'email': 'student2@example.com',
+            'department': 'CS',
+            'year': 2,
+            'subjects': ['CS101', 'CS201']
+        },
+        {
+            'name': 'Michael Lee',
+            'prn': 'IT2001',
+            'email': 'student3@example.com',
+            'department': 'IT',
+            'year': 2,
+            'subjects': ['IT101', 'IT201']
+        },
+        {
+            'name': 'Emily Chen',
+            'prn': 'EC2001',
+            'email': 'student4@example.com',
+            'department': 'EC',
+            'year': 2,
+            'subjects': ['EC101']
+        },
+        {
+            'name': 'David Rodriguez',
+            'prn': 'ME2001',
+            'email': 'student5@example.com',
+            'department': 'ME',
+            'year': 2,
+            'subjects': ['ME101']
+        }
+    ]
+
+    # Create user accounts and student records
+    for student in sample_students:
+        # Check if student already exists
+        existing_student = students.find_one({'prn': student['prn']})
+        if not existing_student:
+            # Create user account
+            user = {
+                'username': student['name'].lower().replace(' ', '.'),
+                'email': student['email'],
+                'password': generate_password_hash('student123', PASSWORD_HASH_METHOD),
+                'role': 'student',
                 'created_at': datetime.datetime.utcnow()
             }
-            users.insert_one(admin_user)
-            print("Admin user created successfully")
-        else:
-            print("Admin user already exists")
 
-    # Create example student accounts
-    def create_student_accounts():
-        # Sample student data
-        sample_students = [
-            {
-                'name': 'John Smith',
-                'prn': 'CS2001',
-                'email': 'student1@example.com',
-                'department': 'CS',
-                'year': 2,
-                'subjects': ['CS101', 'CS201']
-            },
-            {
-                'name': 'Sarah Johnson',
-                'prn': 'CS2002',
-                'email': 'student2@example.com',
-                'department': 'CS',
-                'year': 2,
-                'subjects': ['CS101', 'CS201']
-            },
-            {
-                'name': 'Michael Lee',
-                'prn': 'IT2001',
-                'email': 'student3@example.com',
-                'department': 'IT',
-                'year': 2,
-                'subjects': ['IT101', 'IT201']
-            },
-            {
-                'name': 'Emily Chen',
-                'prn': 'EC2001',
-                'email': 'student4@example.com',
-                'department': 'EC',
-                'year': 2,
-                'subjects': ['EC101']
-            },
-            {
-                'name': 'David Rodriguez',
-                'prn': 'ME2001',
-                'email': 'student5@example.com',
-                'department': 'ME',
-                'year': 2,
-                'subjects': ['ME101']
-            }
-        ]
-        
-        # Create user accounts and student records
-        for student in sample_students:
-            # Check if student already exists
-            existing_student = students.find_one({'prn': student['prn']})
-            if not existing_student:
-                # Create user account
-                user = {
-                    'username': student['name'].lower().replace(' ', '.'),
-                    'email': student['email'],
-                    'password': generate_password_hash('student123'),
-                    'role': 'student',
-                    'created_at': datetime.datetime.utcnow()
-                }
-                
-                # Check if user already exists
-                if not users.find_one({'email': student['email']}):
-                    user_id = users.insert_one(user).inserted_id
-                    
-                    # Add user_id to student record
-                    student['user_id'] = user_id
-                    student['created_at'] = datetime.datetime.utcnow()
-                    
-                    # Insert student record
-                    students.insert_one(student)
-                    print(f"Created student account: {student['name']}")
-                else:
-                    print(f"User account already exists for: {student['email']}")
+            # Check if user already exists
+            if not users.find_one({'email': student['email']}):
+                user_id = users.insert_one(user).inserted_id
+
+                # Add user_id to student record
+                student['user_id'] = user_id
+                student['created_at'] = datetime.datetime.utcnow()
+
+                # Insert student record
+                students.insert_one(student)
+                print(f"Created student account: {student['name']}")
             else:
-                print(f"Student already exists: {student['prn']}")
-    
-    # Create example teacher accounts
-    def create_teacher_accounts():
-        # Sample teacher data
-        sample_teachers = [
-            {
-                'name': 'Professor Wilson',
-                'email': 'teacher1@example.com',
-                'department': 'CS',
-                'subjects': ['CS101', 'CS201']
-            },
-            {
-                'name': 'Professor Martinez',
-                'email': 'teacher2@example.com',
-                'department': 'IT',
-                'subjects': ['IT101', 'IT201']
-            },
-            {
-                'name': 'Professor Thompson',
-                'email': 'teacher3@example.com',
-                'department': 'EC',
-                'subjects': ['EC101']
-            },
-            {
-                'name': 'Professor Garcia',
-                'email': 'teacher4@example.com',
-                'department': 'ME',
-                'subjects': ['ME101']
+                print(f"User account already exists for: {student['email']}")
+        else:
+            print(f"Student already exists: {student['prn']}")
+
+# Create example teacher accounts
+def create_teacher_accounts():
+    # Sample teacher data
+    sample_teachers = [
+        {
+            'name': 'Professor Wilson',
+            'email': 'teacher1@example.com',
+            'department': 'CS',
+            'subjects': ['CS101', 'CS201']
+        },
+        {
+            'name': 'Professor Martinez',
+            'email': 'teacher2@example.com',
+            'department': 'IT',
+            'subjects': ['IT101', 'IT201']
+        },
+        {
+            'name': 'Professor Thompson',
+            'email': 'teacher3@example.com',
+            'department': 'EC',
+            'subjects': ['EC101']
+        },
+        {
+            'name': 'Professor Garcia',
+            'email': 'teacher4@example.com',
+            'department': 'ME',
+            'subjects': ['ME101']
+        }
+    ]
+
+    # Create user accounts and teacher records
+    for teacher in sample_teachers:
+        # Check if teacher already exists
+        existing_teacher = teachers.find_one({'email': teacher['email']})
+        if not existing_teacher:
+            # Create user account
+            user = {
+                'username': teacher['name'].lower().replace(' ', '.'),
+                'email': teacher['email'],
+                'password': generate_password_hash('teacher123', PASSWORD_HASH_METHOD),
+                'role': 'teacher',
+                'created_at': datetime.datetime.utcnow()
             }
-        ]
-        
-        # Create user accounts and teacher records
-        for teacher in sample_teachers:
-            # Check if teacher already exists
-            existing_teacher = teachers.find_one({'email': teacher['email']})
-            if not existing_teacher:
-                # Create user account
-                user = {
-                    'username': teacher['name'].lower().replace(' ', '.'),
-                    'email': teacher['email'],
-                    'password': generate_password_hash('teacher123'),
-                    'role': 'teacher',
-                    'created_at': datetime.datetime.utcnow()
-                }
-                
-                # Check if user already exists
-                if not users.find_one({'email': teacher['email']}):
-                    user_id = users.insert_one(user).inserted_id
-                    
-                    # Add user_id to teacher record
-                    teacher['user_id'] = user_id
-                    teacher['created_at'] = datetime.datetime.utcnow()
-                    
-                    # Insert teacher record
-                    teachers.insert_one(teacher)
-                    print(f"Created teacher account: {teacher['name']}")
-                else:
-                    print(f"User account already exists for: {teacher['email']}")
+
+            # Check if user already exists
+            if not users.find_one({'email': teacher['email']}):
+                user_id = users.insert_one(user).inserted_id
+
+                # Add user_id to teacher record
+                teacher['user_id'] = user_id
+                teacher['created_at'] = datetime.datetime.utcnow()
+
+                # Insert teacher record
+                teachers.insert_one(teacher)
+                print(f"Created teacher account: {teacher['name']}")
             else:
-                print(f"Teacher already exists: {teacher['email']}")
+                print(f"User account already exists for: {teacher['email']}")
+        else:
+            print(f"Teacher already exists: {teacher['email']}")
+
+def enable_counter_pre_images():
+    """Keep each counter's value before a change, so the live feed knows how far it moved"""
+    try:
+        get_db().command('collMod', 'attendance_counters', changeStreamPreAndPostImages={'enabled': True})
+        print("Change stream pre-images enabled for attendance_counters")
+    except OperationFailure as e:
+        # Before MongoDB 6.0 the feed falls back to the last count it saw
+        print(f"Could not enable change stream pre-images: {e}")
 
-    # Create users on startup
-    with app.app_context():
+def bootstrap():
+    """One-shot setup: check the connection, create indexes and seed sample accounts"""
+    try:
+        started = time.perf_counter()
+        
+        # Test the connection
+        get_client().server_info()
+        print("Successfully connected to MongoDB Atlas")
+        
+        create_indexes()
+        if SSE_CHANGE_STREAM:
+            enable_counter_pre_images()
         create_admin_user()
         initialize_sample_data()
         create_student_accounts()
         create_teacher_accounts()
+        invalidate_all_users()
+        
+        print(f"Bootstrap completed in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        print(f"Error connecting to MongoDB Atlas: {str(e)}")
+        raise
+
+# Login bookkeeping (last_login, first-login IP binding) is written in the background
+login_writes = WriteBuffer(users)
+# Per-session scan statistics are not needed by the scanning student, so they are written in the background
+session_stat_writes = WriteBuffer(class_sessions)
+
+# Class sessions a teacher closed early; everything else about a scan is verified from its signature
+closed_qr_sessions = ClosedSessionList(class_sessions)
+
+# In-process fan-out of scan events to SSE subscribers, keyed by class session id
+attendance_events = EventBroker()
+
+# Maintained per-subject, per-day scan counts (see scripts/reconcile_counters.py)
+attendance_counter_store = AttendanceCounters(attendance_counters, attendance_records, ttl=PRESENT_COUNT_TTL)
+# Monthly present/total per student and subject, so summaries never scan raw history
+attendance_rollup_store = AttendanceRollups(attendance_rollups, attendance_records, attendance_counters, students)
+# Defaulter lists and heatmaps for administrators
+department_analytics = DepartmentAnalytics(
+    students, attendance_records, attendance_counters, ttl=ANALYTICS_CACHE_TTL, maxsize=ANALYTICS_CACHE_SIZE
+)
+
+revocation_list = RevocationList(revoked_tokens, refresh_seconds=REVOCATION_REFRESH_SECONDS)
 
-except Exception as e:
-    print(f"Error connecting to MongoDB Atlas: {str(e)}")
-    raise
+def clear_account_caches():
+    user_cache.clear()
+    student_cache.clear()
+    enrollment_cache.clear()
+    roster_cache.clear()
+
+# Bulk account changes from other processes (bootstrap, init scripts) reach this worker here
+account_version = VersionWatch(catalog_meta, ACCOUNTS_ID, clear_account_caches, check_seconds=CATALOG_CHECK_SECONDS)
+
+def invalidate_user(user_id):
+    """Apply a role or account change: revoke the user's tokens and drop their cached records
+
+    Tokens carry the role, and STATELESS_AUTH trusts it, so the user must log in again.
+    """
+    revocation_list.revoke_user(user_id, TOKEN_LIFETIME)
+    user_cache.invalidate(str(user_id))
+    student_cache.invalidate(str(user_id))
+    enrollment_cache.clear()
+    roster_cache.clear()
+
+def invalidate_all_users():
+    """Drop every cached user and student profile in every worker, e.g. after a bulk import"""
+    bump_catalog_version(catalog_meta, ACCOUNTS_ID)
+    clear_account_caches()
+
+def get_cached_user(user_id):
+    """Return the slim user record for user_id, hitting the database only on a cache miss"""
+    account_version.check()
+    user = user_cache.get(user_id)
+    if user is None:
+        user = users.find_one({'_id': ObjectId(user_id)}, USER_CACHE_PROJECTION)
+        if user:
+            user_cache.set(user_id, user)
+    return user
+
+def get_student(user_id):
+    """Return the cached student profile for a user; callers must not mutate it"""
+    user_id = str(user_id)
+    account_version.check()
+    student = student_cache.get(user_id)
+    if student is None:
+        student = students.find_one({'user_id': ObjectId(user_id)})
+        if student:
+            student_cache.set(user_id, student)
+    return student
+
+def get_teacher(teacher_id):
+    """Return the cached teacher document for a teacher id string"""
+    teacher = teacher_cache.get(teacher_id)
+    if teacher is None:
+        teacher = teachers.find_one({'_id': ObjectId(teacher_id)})
+        if teacher:
+            teacher_cache.set(teacher_id, teacher)
+    return teacher
+
+def get_teacher_by_user(user_id):
+    """Return the cached teacher document for a user id"""
+    key = f"user:{user_id}"
+    teacher = teacher_cache.get(key)
+    if teacher is None:
+        teacher = teachers.find_one({'user_id': ObjectId(user_id)})
+        if teacher:
+            teacher_cache.set(key, teacher)
+    return teacher
+
+def get_class_session(teacher, subject):
+    """Return the teacher's running session for a subject, starting one if needed"""
+    key = (str(teacher['_id']), subject['code'])
+    now = datetime.datetime.utcnow()
+    session = class_session_cache.get(key)
+    if session is None or session['expires_at'] <= now or closed_qr_sessions.is_closed(str(session['_id'])):
+        session = class_sessions.find_one(
+            {
+                'teacher_id': key[0],
+                'subject_code': key[1],
+                'is_active': True,
+                'expires_at': {'$gt': now}
+            },
+            sort=[('expires_at', -1)]
+        )
+        if session is None:
+            session = {
+                'teacher_id': key[0],
+                'teacher_name': teacher['name'],
+                'subject_code': subject['code'],
+                'subject_name': subject['name'],
+                'department': subject.get('department', ''),
+                'classroom': subject.get('classroom', ''),
+                'started_at': now,
+                'expires_at': now + datetime.timedelta(minutes=CLASS_SESSION_MINUTES),
+                'is_active': True,
+                'enrolled_students_count': get_enrolled_count(subject['code'])
+            }
+            session['_id'] = class_sessions.insert_one(session).inserted_id
+        class_session_cache.set(key, session)
+    return session
+
+def get_enrolled_count(subject_code):
+    """Return the cached number of students enrolled in a subject"""
+    count = enrollment_cache.get(subject_code)
+    if count is None:
+        count = students.count_documents({'subjects': subject_code})
+        enrollment_cache.set(subject_code, count)
+    return count
+
+def get_roster(subject_code):
+    """Return the cached roster for a subject as {student id string: student}"""
+    roster = roster_cache.get(subject_code)
+    if roster is None:
+        roster = {
+            str(student['_id']): student
+            for student in students.find(
+                {'subjects': subject_code},
+                {'name': 1, 'prn': 1, 'department': 1, 'year': 1}
+            )
+        }
+        roster_cache.set(subject_code, roster)
+    return roster
+
+def summarize_attendance(student, subject_groups):
+    """Turn per-subject present/total groups into the overall and bySubject summaries"""
+    # Create a dictionary of all subjects enrolled
+    by_subject = {}
+    for subject_code in student['subjects']:
+        by_subject[subject_catalog.name(subject_code)] = {'present': 0, 'total': 0}
+    
+    # Merge per-subject totals, resolving names from the catalog
+    overall = {'present': 0, 'total': 0}
+    for group in subject_groups:
+        totals = by_subject.setdefault(subject_catalog.name(group['_id']), {'present': 0, 'total': 0})
+        totals['present'] += group['present']
+        totals['total'] += group['total']
+        overall['present'] += group['present']
+        overall['total'] += group['total']
+    
+    return overall, by_subject
+
+def build_attendance_record(student, qr_claims, scanned_at):
+    """Return the (unique key, fields) of the record for a student's verified scan"""
+    teacher = get_teacher(qr_claims['teacher_id'])
+    attendance_key = {
+        'student_id': student['_id'],
+        'subject_code': qr_claims['subject_code'],
+        'date': scanned_at.strftime('%Y-%m-%d')
+    }
+    attendance_record = {
+        'student_name': student['name'],
+        'student_prn': student['prn'],
+        'department': student['department'],
+        'year': student['year'],
+        'subject_name': subject_catalog.name(qr_claims['subject_code']),
+        'session_id': ObjectId(qr_claims['session_id']),
+        'status': 'present',
+        'time': scanned_at.strftime('%H:%M:%S'),
+        'timestamp': scanned_at,
+        'teacher_id': qr_claims['teacher_id'],
+        'teacher_name': teacher['name'] if teacher else ''
+    }
+    return attendance_key, attendance_record
+
+def parse_scan_time(value):
+    """Parse a device scan time (epoch seconds or ISO 8601) into naive UTC, or None"""
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return datetime.datetime.utcfromtimestamp(value)
+        scanned_at = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if scanned_at.tzinfo is not None:
+        scanned_at = scanned_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return scanned_at
+
+def format_attendance_record(record):
+    """Format an attendance record for the student dashboard"""
+    return {
+        'date': f"{record['date']}T{record['time']}Z",
+        'subject': subject_catalog.name(record['subject_code']),
+        'status': record['status'],
+        'time': record['time']
+    }
+
+def compute_attendance_status(subject_code, date):
+    """Build the class status for a subject and date with the join done server-side"""
+    roster = list(students.aggregate([
+        {'$match': {'subjects': subject_code}},
+        {'$project': {'name': 1, 'prn': 1, 'department': 1, 'year': 1}},
+        {'$lookup': {
+            'from': 'attendance_records',
+            'let': {'student_id': '$_id'},
+            'pipeline': [
+                {'$match': {
+                    'subject_code': subject_code,
+                    'date': date,
+                    'status': 'present',
+                    '$expr': {'$eq': ['$student_id', '$$student_id']}
+                }},
+                {'$project': {'_id': 1}},
+                {'$limit': 1}
+            ],
+            'as': 'attendance'
+        }},
+        {'$project': {
+            '_id': 0,
+            'id': {'$toString': '$_id'},
+            'name': 1,
+            'prn': 1,
+            'department': 1,
+            'year': 1,
+            'status': {'$cond': [{'$gt': [{'$size': '$attendance'}, 0]}, 'present', 'absent']}
+        }}
+    ]))
+    
+    present_count = sum(1 for student in roster if student['status'] == 'present')
+    return {
+        'date': date,
+        'subject_code': subject_code,
+        'total_students': len(roster),
+        'present_count': present_count,
+        'absent_count': len(roster) - present_count,
+        'attendance_percentage': round(present_count / len(roster) * 100) if roster else 0,
+        'students': roster
+    }
+
+def get_attendance_status_cached(subject_code, date):
+    """Return class status from a short-TTL cache; concurrent pollers share one computation"""
+    key = (subject_code, date)
+    status = attendance_status_cache.get(key)
+    if status is None:
+        generation = attendance_status_generations.get(key, 0)
+        def compute():
+            result = compute_attendance_status(subject_code, date)
+            if attendance_status_generations.get(key, 0) == generation:
+                attendance_status_cache.set(key, result)
+            return result
+        # Pollers arriving after a change start a new computation instead of joining an older one
+        status = attendance_status_flight.do((key, generation), compute)
+    return status
+
+def invalidate_attendance_status(subject_code, date):
+    """Drop a class's cached status after its attendance changed"""
+    key = (subject_code, date)
+    attendance_status_generations.set(key, next(attendance_status_generation_counter))
+    attendance_status_cache.invalidate(key)
+
+def build_attendance_event(record, marked):
+    """Build the (channel, event) pair published when a student is marked present"""
+    enrolled_count = get_enrolled_count(record['subject_code'])
+    return str(record['session_id']), {
+        'student_id': str(record['student_id']),
+        'student_name': record['student_name'],
+        'student_prn': record['student_prn'],
+        'time': record['time'],
+        'present_students': marked,
+        'enrolled_students': enrolled_count,
+        'percentage': round((marked / enrolled_count * 100) if enrolled_count > 0 else 0)
+    }
+
+# With several workers, scans reach every worker's feed through a change stream; each is
+# sent once the day's counter change that includes it arrives
+scan_count_pairing = ScanCountPairing('attendance_records', 'attendance_counters', build_attendance_event)
+attendance_change_relay = ChangeStreamRelay(
+    db, scan_count_pairing.pipeline(), attendance_events, scan_count_pairing.handle,
+    full_document='updateLookup', full_document_before_change='whenAvailable'
+)
+
+# Values sampled from live objects each time metrics are published
+metrics.gauge('attendmax_password_hash_pending', 'Password hash jobs queued or running')
+metrics.counter('attendmax_password_hash_rejected_total', 'Password hash jobs rejected because the queue was full')
+metrics.counter('attendmax_write_buffer_flushed_total', 'Buffered writes flushed to MongoDB')
+metrics.counter('attendmax_write_buffer_errors_total', 'Buffered write batches that failed')
+metrics.counter('attendmax_cache_hits_total', 'In-process cache hits')
+metrics.counter('attendmax_cache_misses_total', 'In-process cache misses')
+metrics.counter('attendmax_singleflight_shared_total', 'Calls that joined an identical computation in flight')
+metrics.ratio(
+    'attendmax_cache_hit_ratio', 'In-process cache hit ratio',
+    'attendmax_cache_hits_total', ['attendmax_cache_hits_total', 'attendmax_cache_misses_total']
+)
+metrics.gauge('attendmax_sse_subscribers', 'Open live attendance feeds')
+
+@metrics.collector
+def collect_runtime_metrics(registry):
+    registry.set('attendmax_password_hash_pending', hash_pool.pending)
+    registry.set('attendmax_password_hash_rejected_total', hash_pool.rejected)
+    for name, buffer in [('login', login_writes), ('session_stats', session_stat_writes)]:
+        registry.set('attendmax_write_buffer_flushed_total', buffer.flushed, buffer=name)
+        registry.set('attendmax_write_buffer_errors_total', buffer.errors, buffer=name)
+    caches = [
+        ('user', user_cache), ('student', student_cache), ('teacher', teacher_cache),
+        ('class_session', class_session_cache), ('enrollment', enrollment_cache), ('roster', roster_cache),
+        ('attendance_status', attendance_status_cache), ('present_count', attendance_counter_store.cache),
+        ('analytics', department_analytics.cache)
+    ]
+    for name, cache in caches:
+        stats = cache.stats()
+        registry.set('attendmax_cache_hits_total', stats['hits'], cache=name)
+        registry.set('attendmax_cache_misses_total', stats['misses'], cache=name)
+    for name, flight in [('attendance_status', attendance_status_flight), ('analytics', department_analytics.flight)]:
+        registry.set('attendmax_singleflight_shared_total', flight.shared, flight=name)
+    registry.set('attendmax_sse_subscribers', attendance_events.subscriber_count())
 
 # Middleware for JWT authentication
 def authenticate_token(f):
@@ -258,15 +763,28 @@ def authenticate_token(f):
                 algorithms=['HS256']
             )
             
-            # Get user from database
-            user = users.find_one({'_id': ObjectId(payload['user_id'])})
-            if not user:
-                return jsonify({'error': 'User not found'}), 404
+            if revocation_list.is_revoked(payload):
+                return jsonify({'error': 'Token has been revoked'}), 401
+            
+            if STATELESS_AUTH and payload.get('jti'):
+                # Trust the signed claims; logout and invalidate_user revoke tokens
+                user = {
+                    '_id': ObjectId(payload['user_id']),
+                    'username': payload.get('username'),
+                    'email': payload.get('email'),
+                    'role': payload['role']
+                }
+            else:
+                # Get user from cache, falling back to the database
+                user = get_cached_user(payload['user_id'])
+                if not user:
+                    return jsonify({'error': 'User not found'}), 404
             
             # Add user to request context
             request.user = user
             request.user_id = payload['user_id']
             request.role = payload['role']
+            request.token_payload = payload
             
             return f(*args, **kwargs)
         except jwt.ExpiredSignatureError:
@@ -277,38 +795,50 @@ def authenticate_token(f):
     decorated.__name__ = f.__name__
     return decorated
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login():
     data = request.get_json()
     
-    # Add debugging to monitor login attempts
-    print(f"Login attempt: {data.get('email')}, Role: {data.get('role')}")
+    log_event('login_attempt', email=data.get('email'), role=data.get('role'))
     
     if 'email' not in data or 'password' not in data:
         return jsonify({'error': 'Email and password are required'}), 400
     
     user = users.find_one({'email': data['email']})
     
-    # Debug user lookup
-    if user:
-        print(f"User found: {user.get('email')}, Role: {user.get('role')}")
-    else:
-        print(f"No user found with email: {data.get('email')}")
+    if not user:
+        log_event('login_failed', email=data.get('email'), reason='unknown_email')
         return jsonify({'error': 'Invalid email or password'}), 401
     
-    # Check password match
-    if not check_password_hash(user['password'], data['password']):
-        print(f"Password mismatch for user: {user.get('email')}")
+    # Check password match on the hashing pool
+    try:
+        password_ok = verify_password(user['password'], data['password'])
+    except HashPoolBusy:
+        return jsonify({'error': 'Server is busy, please try again'}), 503, {'Retry-After': '1'}
+    
+    if not password_ok:
+        log_event('login_failed', email=user.get('email'), reason='password')
         return jsonify({'error': 'Invalid email or password'}), 401
     
+    # Transparently upgrade hashes made with outdated parameters
+    if needs_rehash(user['password']):
+        try:
+            users.update_one(
+                {'_id': user['_id'], 'password': user['password']},
+                {'$set': {'password': hash_password(data['password'])}}
+            )
+        except HashPoolBusy:
+            # Under load the upgrade simply waits for a later login
+            pass
+    
     # Check role if provided
     if 'role' in data and data['role'] and user['role'] != data['role']:
-        print(f"Role mismatch: User role: {user.get('role')}, Requested role: {data.get('role')}")
+        log_event('login_failed', email=user.get('email'), reason='role', role=user.get('role'), requested_role=data.get('role'))
         # For teacher accounts, check if they exist in the teachers collection
         if data['role'] == 'teacher':
             teacher = teachers.find_one({'user_id': user['_id']})
             if not teacher:
-                print(f"Teacher record not found for user_id: {user.get('_id')}")
+                log_event('teacher_record_missing', logging.WARNING, user_id=user.get('_id'))
                 return jsonify({'error': 'Access denied. Teacher account not found.'}), 403
         return jsonify({'error': 'Access denied. Please check your role selection.'}), 403
     
@@ -316,7 +846,6 @@ def login():
     if user['role'] == 'teacher':
         teacher = teachers.find_one({'user_id': user['_id']})
         if not teacher:
-            print(f"Teacher record not found for user: {user.get('email')}")
             # Create a teacher record if it doesn't exist
             teacher_data = {
                 'name': user['username'],
@@ -327,37 +856,33 @@ def login():
                 'created_at': datetime.datetime.utcnow()
             }
             teachers.insert_one(teacher_data)
-            print(f"Created missing teacher record for: {user.get('email')}")
+            log_event('teacher_record_created', logging.WARNING, email=user.get('email'))
     
     # Check IP address for first login
     client_ip = request.remote_addr
     
-    # If this is the first login, save the IP
+    # If this is the first login, save the IP. The first_login guard in the filter
+    # makes the binding apply exactly once even if several logins race to the queue.
     if 'first_login' not in user or user['first_login'] == True:
-        users.update_one(
-            {'_id': user['_id']},
+        login_writes.add(UpdateOne(
+            {'_id': user['_id'], 'first_login': {'$ne': False}},
             {
                 '$set': {
                     'registered_ip': client_ip,
-                    'first_login': False,
-                    'last_login': datetime.datetime.utcnow()
+                    'first_login': False
                 }
             }
-        )
+        ))
     else:
         # For subsequent logins, check IP if registered_ip exists
         if 'registered_ip' in user and user['registered_ip'] and user['registered_ip'] != client_ip:
-            print(f"Warning: User logged in from different IP. Registered: {user['registered_ip']}, Current: {client_ip}")
-        
-        # Update last login time
-        users.update_one(
-            {'_id': user['_id']},
-            {
-                '$set': {
-                    'last_login': datetime.datetime.utcnow()
-                }
-            }
-        )
+            log_event('login_ip_changed', email=user.get('email'), registered_ip=user['registered_ip'], ip=client_ip)
+    
+    # Update last login time; $max keeps the latest value whatever order batches land in
+    login_writes.add(
+        UpdateOne({'_id': user['_id']}, {'$max': {'last_login': datetime.datetime.utcnow()}}),
+        key=('last_login', user['_id'])
+    )
     
     # Generate JWT token
     token = jwt.encode(
@@ -366,13 +891,18 @@ def login():
             'username': user['username'],
             'email': user['email'],
             'role': user['role'],
-            'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1)
+            'jti': uuid.uuid4().hex,
+            'iat': datetime.datetime.utcnow(),
+            'exp': datetime.datetime.utcnow() + TOKEN_LIFETIME
         },
         JWT_SECRET_KEY,
         algorithm='HS256'
     )
     
-    print(f"Login successful for: {user.get('email')}, Role: {user.get('role')}")
+    # Refresh the cached user so the token's first requests hit a warm cache
+    user_cache.set(str(user['_id']), {field: user.get(field) for field in ['_id', *USER_CACHE_PROJECTION]})
+    
+    log_event('login_succeeded', email=user.get('email'), role=user.get('role'))
     
     return jsonify({
         'message': 'Login successful',
@@ -387,7 +917,17 @@ def login():
         }
     }), 200
 
-@app.route('/api/students', methods=['GET'])
+@api.route('/api/auth/logout', methods=['POST'])
+@authenticate_token
+def logout():
+    # Tokens issued before revocation support have no jti and simply expire
+    if not request.token_payload.get('jti'):
+        return jsonify({'message': 'Logout successful'}), 200
+    
+    revocation_list.revoke_token(request.token_payload)
+    return jsonify({'message': 'Logout successful'}), 200
+
+@api.route('/api/students', methods=['GET'])
 @authenticate_token
 def get_students():
     # Check if user is a teacher or admin
@@ -405,8 +945,17 @@ def get_students():
     if year:
         query['year'] = int(year)
     
+    # Optional keyset pagination on _id and incremental streaming
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        if request.args.get('after'):
+            query['_id'] = {'$gt': ObjectId(decode_cursor(request.args['after'], 1)[0])}
+    except (ValueError, InvalidCursor, InvalidId):
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    stream = request.args.get('stream', '').lower() in ('true', '1', 't')
+    
     # Query students
-    student_list = list(students.find(query, {
+    cursor = students.find(query, {
         '_id': 1, 
         'name': 1, 
         'prn': 1, 
@@ -414,17 +963,25 @@ def get_students():
         'year': 1, 
         'email': 1, 
         'subjects': 1
-    }))
+    }).sort('_id', 1).batch_size(STREAM_BATCH_SIZE)
+    page = KeysetPage(cursor, limit, key=lambda student: (student['_id'],))
     
     # Convert ObjectId to string for JSON serialization
-    for student in student_list:
+    def serialize(student):
         student['_id'] = str(student['_id'])
+        return student
     
-    return jsonify({
-        'students': student_list
-    }), 200
+    if stream:
+        return stream_json_response({}, 'students', map(serialize, page), tail=lambda: {'next': page.next})
+    
+    student_list = [serialize(student) for student in page]
+    response = {'students': student_list}
+    if limit:
+        response['next'] = page.next
+    
+    return jsonify(response), 200
 
-@app.route('/api/student/profile', methods=['GET'])
+@api.route('/api/student/profile', methods=['GET'])
 @authenticate_token
 def get_student_profile():
     # Check if user is a student
@@ -432,11 +989,12 @@ def get_student_profile():
         return jsonify({'error': 'Access denied. This endpoint is for students only.'}), 403
     
     # Get student profile
-    student = students.find_one({'user_id': ObjectId(request.user_id)})
+    student = get_student(request.user_id)
     if not student:
         return jsonify({'error': 'Student profile not found'}), 404
     
     # Remove sensitive fields and convert ObjectId to string
+    student = dict(student)
     student['_id'] = str(student['_id'])
     student['user_id'] = str(student['user_id'])
     
@@ -444,7 +1002,7 @@ def get_student_profile():
         'student': student
     }), 200
 
-@app.route('/api/teacher/profile', methods=['GET'])
+@api.route('/api/teacher/profile', methods=['GET'])
 @authenticate_token
 def get_teacher_profile():
     # Check if user is a teacher
@@ -464,7 +1022,7 @@ def get_teacher_profile():
         'teacher': teacher
     }), 200
 
-@app.route('/api/subjects', methods=['GET'])
+@api.route('/api/subjects', methods=['GET'])
 @authenticate_token
 def get_subjects():
     # Get query parameters
@@ -478,8 +1036,8 @@ def get_subjects():
     if year:
         query['year'] = int(year)
     
-    # Query subjects
-    subject_list = list(subjects.find(query))
+    # Query subjects from the in-memory catalog
+    subject_list = [dict(subject) for subject in subject_catalog.find(**query)]
     
     # Convert ObjectId to string for JSON serialization
     for subject in subject_list:
@@ -490,7 +1048,7 @@ def get_subjects():
         'subjects': subject_list
     }), 200
 
-@app.route('/api/teacher/generate_qr', methods=['POST'])
+@api.route('/api/teacher/generate_qr', methods=['POST'])
 @authenticate_token
 def generate_qr_code():
     # Check if user is a teacher
@@ -499,14 +1057,13 @@ def generate_qr_code():
     
     try:
         data = request.get_json()
-        print(f"QR Generation request data: {data}")
         
         # Validate input
         if 'subject_code' not in data:
             return jsonify({'error': 'Missing required field: subject_code'}), 400
         
         # Get teacher info
-        teacher = teachers.find_one({'user_id': ObjectId(request.user_id)})
+        teacher = get_teacher_by_user(request.user_id)
         if not teacher:
             return jsonify({'error': 'Teacher profile not found'}), 404
         
@@ -515,61 +1072,146 @@ def generate_qr_code():
             return jsonify({'error': f"Teacher does not teach subject '{data['subject_code']}'"}), 403
         
         # Get subject info
-        subject = subjects.find_one({'code': data['subject_code']})
+        subject = subject_catalog.get(data['subject_code'])
         if not subject:
             return jsonify({'error': f"Subject '{data['subject_code']}' not found"}), 404
         
-        # Get enrolled students for this subject
-        enrolled_students = list(students.find({'subjects': data['subject_code']}))
-        enrolled_count = len(enrolled_students)
+        # Refreshes reuse the running class session, so only the first call writes
+        session = get_class_session(teacher, subject)
         
-        # Fixed 15-second QR code validity
-        valid_seconds = 15
-        expiry_time = datetime.datetime.utcnow() + datetime.timedelta(seconds=valid_seconds)
+        # Fixed 15-second QR code validity, never past the end of the session
+        valid_seconds = QR_VALID_SECONDS
+        expiry_time = min(
+            datetime.datetime.utcnow() + datetime.timedelta(seconds=valid_seconds),
+            session['expires_at']
+        )
+        expiry_timestamp = calendar.timegm(expiry_time.utctimetuple())
         
         # Get current attendance count for today
         today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
-        attendance_query = {
-            'subject_code': data['subject_code'],
-            'date': today
-        }
-        present_count = attendance_records.count_documents(attendance_query)
-        
-        qr_data = {
-            'teacher_id': str(teacher['_id']),
-            'teacher_name': teacher['name'],
-            'subject_code': data['subject_code'],
-            'subject_name': subject['name'],
-            'department': subject.get('department', ''),
-            'classroom': subject.get('classroom', ''),
-            'generated_at': datetime.datetime.utcnow(),
-            'expires_at': expiry_time,
-            'is_active': True,
-            'enrolled_students_count': enrolled_count
-        }
+        present_count = attendance_counter_store.get(data['subject_code'], today)
         
-        # Save QR code data
-        qr_id = qr_codes.insert_one(qr_data).inserted_id
-        
-        # Create a unique code for QR
-        unique_code = f"{data['subject_code']}:{str(qr_id)}:{int(expiry_time.timestamp())}"
+        # Derive a rotating signed code from the session; mark_attendance verifies it without a lookup
+        unique_code = sign_qr_token(QR_SECRET_KEY, data['subject_code'], session['_id'], teacher['_id'], expiry_timestamp)
         
         response_data = {
             'qr_code': unique_code,
+            'session_id': str(session['_id']),
+            'session_expires_at': session['expires_at'].strftime('%Y-%m-%dT%H:%M:%S.%f'),
             'expires_at': expiry_time.strftime('%Y-%m-%dT%H:%M:%S.%f'),
             'valid_for_seconds': valid_seconds,
             'subject_name': subject['name'],
-            'enrolled_students': enrolled_count,
+            'enrolled_students': session['enrolled_students_count'],
             'present_students': present_count
         }
-        print(f"Generated QR code: {unique_code}")
+        log_event('qr_generated', logging.DEBUG, subject_code=data['subject_code'], session_id=str(session['_id']))
         
         return jsonify(response_data), 200
     except Exception as e:
-        print(f"Error in QR code generation: {str(e)}")
+        log_event('qr_generation_failed', logging.ERROR, exc_info=True, error=str(e))
         return jsonify({'error': f'Failed to generate QR code: {str(e)}'}), 500
 
-@app.route('/api/attendance/mark', methods=['POST'])
+@api.route('/api/teacher/close_qr', methods=['POST'])
+@authenticate_token
+def close_qr_code():
+    # Check if user is a teacher
+    if request.role != 'teacher':
+        return jsonify({'error': 'Access denied. This endpoint is for teachers only.'}), 403
+    
+    data = request.get_json() or {}
+    
+    # Accept the session id, or any code from the session even if it has since expired
+    if data.get('session_id'):
+        session_id = data['session_id']
+    elif data.get('qr_code'):
+        try:
+            session_id = verify_qr_token(QR_SECRET_KEY, data['qr_code'], now=0)['session_id']
+        except InvalidQRCode:
+            return jsonify({'error': 'Invalid QR code format'}), 400
+    else:
+        return jsonify({'error': 'Missing required field: session_id'}), 400
+    try:
+        session_object_id = ObjectId(session_id)
+    except (InvalidId, TypeError):
+        return jsonify({'error': 'Invalid session_id'}), 400
+    
+    # Get teacher info
+    teacher = get_teacher_by_user(request.user_id)
+    if not teacher:
+        return jsonify({'error': 'Teacher profile not found'}), 404
+    
+    session = class_sessions.find_one_and_update(
+        {'_id': session_object_id, 'teacher_id': str(teacher['_id'])},
+        {'$set': {'is_active': False, 'closed_at': datetime.datetime.utcnow()}},
+        projection={'subject_code': 1, 'started_at': 1}
+    )
+    if session is None:
+        return jsonify({'error': 'Class session not found'}), 404
+    closed_qr_sessions.close(session_id)
+    
+    # The class is over: everyone enrolled who has not been marked counts as absent
+    attendance_rollup_store.count_absences(session['subject_code'], session['started_at'].strftime('%Y-%m-%d'))
+    
+    return jsonify({'message': 'Class session closed'}), 200
+
+@api.route('/api/teacher/session/<session_id>/events', methods=['GET'])
+@authenticate_token
+def class_session_events(session_id):
+    # Check if user is a teacher
+    if request.role != 'teacher':
+        return jsonify({'error': 'Access denied. This endpoint is for teachers only.'}), 403
+    
+    # Get teacher info
+    teacher = get_teacher_by_user(request.user_id)
+    if not teacher:
+        return jsonify({'error': 'Teacher profile not found'}), 404
+    
+    try:
+        session = class_sessions.find_one({'_id': ObjectId(session_id), 'teacher_id': str(teacher['_id'])})
+    except InvalidId:
+        session = None
+    if not session:
+        return jsonify({'error': 'Class session not found'}), 404
+    
+    # The relay starts with the first subscriber so idle workers hold no change stream
+    if SSE_CHANGE_STREAM:
+        attendance_change_relay.start()
+    
+    subscriber = attendance_events.subscribe(session_id)
+    
+    def generate():
+        try:
+            # Start with a snapshot so the screen does not need a separate status call
+            today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+            marked = attendance_counter_store.get(session['subject_code'], today)
+            enrolled_count = session.get('enrolled_students_count', 0)
+            yield format_sse({
+                'session_id': session_id,
+                'subject_code': session['subject_code'],
+                'present_students': marked,
+                'enrolled_students': enrolled_count,
+                'percentage': round((marked / enrolled_count * 100) if enrolled_count > 0 else 0)
+            }, event='snapshot')
+            
+            while datetime.datetime.utcnow() < session['expires_at'] and not closed_qr_sessions.is_closed(session_id):
+                try:
+                    event = subscriber.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # Comment lines keep proxies from closing an idle stream
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_sse(event, event='attendance', event_id=event['present_students'])
+            yield format_sse({'session_id': session_id}, event='closed')
+        finally:
+            attendance_events.unsubscribe(session_id, subscriber)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@api.route('/api/attendance/mark', methods=['POST'])
 @authenticate_token
 def mark_attendance():
     # Check if user is a student
@@ -582,49 +1224,51 @@ def mark_attendance():
     if 'qr_data' not in data:
         return jsonify({'error': 'QR data is required'}), 400
     
-    # Parse QR data
+    # Verify the signed QR data
     try:
-        parts = data['qr_data'].split(':')
-        if len(parts) != 3:
-            return jsonify({'error': 'Invalid QR code format'}), 400
-        
-        subject_code = parts[0]
-        qr_id = parts[1]
-        expiry_timestamp = int(parts[2])
-        
-        # Check if QR code has expired
+        qr_claims = verify_qr_token(QR_SECRET_KEY, data['qr_data'])
+    except ExpiredQRCode:
+        return jsonify({'error': 'QR code has expired'}), 400
+    except InvalidQRCode:
+        return jsonify({'error': 'Invalid QR code format'}), 400
+    
+    try:
+        subject_code = qr_claims['subject_code']
+        session_id = qr_claims['session_id']
         current_time = datetime.datetime.utcnow()
-        expiry_time = datetime.datetime.fromtimestamp(expiry_timestamp)
         
-        if current_time > expiry_time:
-            return jsonify({'error': 'QR code has expired'}), 400
-        
-        # Check if QR code exists and is active
-        qr_code = qr_codes.find_one({'_id': ObjectId(qr_id), 'is_active': True})
-        if not qr_code:
+        # Check if the teacher closed this class session early
+        if closed_qr_sessions.is_closed(session_id):
             return jsonify({'error': 'Invalid or inactive QR code'}), 400
         
         # Get student info
-        student = students.find_one({'user_id': ObjectId(request.user_id)})
+        student = get_student(request.user_id)
         if not student:
             return jsonify({'error': 'Student profile not found'}), 404
         
         # Check if student is enrolled in this subject
         if subject_code not in student['subjects']:
-            return jsonify({'error': f"You are not enrolled in {qr_code.get('subject_name', subject_code)}"}), 403
+            return jsonify({'error': f"You are not enrolled in {subject_catalog.name(subject_code)}"}), 403
         
-        # Check if attendance has already been marked
-        existing_attendance = attendance_records.find_one({
-            'student_id': student['_id'],
-            'subject_code': subject_code,
-            'date': current_time.strftime('%Y-%m-%d')
-        })
+        attendance_key, attendance_record = build_attendance_record(student, qr_claims, current_time)
+        subject_name = attendance_record['subject_name']
+        today = attendance_key['date']
+        
+        # Mark attendance with a single atomic upsert; an existing document means
+        # the student was already marked and is returned instead of being modified
+        try:
+            existing_attendance = attendance_records.find_one_and_update(
+                attendance_key,
+                {'$setOnInsert': attendance_record},
+                projection={'date': 1, 'status': 1, 'time': 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # A concurrent scan by the same student won the insert
+            existing_attendance = attendance_records.find_one(attendance_key, {'date': 1, 'status': 1, 'time': 1})
         
         if existing_attendance:
-            # Get more details for the response
-            subject_info = subjects.find_one({'code': subject_code})
-            subject_name = subject_info['name'] if subject_info else subject_code
-            
             return jsonify({
                 'error': 'Attendance already marked for today',
                 'record': {
@@ -635,52 +1279,34 @@ def mark_attendance():
                 }
             }), 400
         
-        # Get more details about the subject
-        subject_info = subjects.find_one({'code': subject_code})
-        subject_name = subject_info['name'] if subject_info else subject_code
-        
-        # Mark attendance
-        attendance_record = {
-            'student_id': student['_id'],
-            'student_name': student['name'],
-            'student_prn': student['prn'],
-            'department': student['department'],
-            'year': student['year'],
-            'subject_code': subject_code,
-            'subject_name': subject_name,
-            'qr_code_id': ObjectId(qr_id),
-            'status': 'present',
-            'date': current_time.strftime('%Y-%m-%d'),
-            'time': current_time.strftime('%H:%M:%S'),
-            'timestamp': current_time,
-            'teacher_id': qr_code.get('teacher_id'),
-            'teacher_name': qr_code.get('teacher_name', '')
-        }
-        
-        attendance_records.insert_one(attendance_record)
-        
-        # Update stats in QR code document
-        qr_codes.update_one(
-            {'_id': ObjectId(qr_id)},
+        # Update stats in class session document
+        session_stat_writes.add(UpdateOne(
+            {'_id': ObjectId(session_id)},
             {'$inc': {'marked_attendance_count': 1}}
-        )
+        ))
         
-        # Get total count of student attendance for today
-        today_count = attendance_records.count_documents({
-            'subject_code': subject_code,
-            'date': current_time.strftime('%Y-%m-%d')
-        })
+        counter = attendance_counter_store.increment_state(subject_code, today)
+        today_count = counter['marked']
+        invalidate_attendance_status(subject_code, today)
+        attendance_rollup_store.record_change(
+            student['_id'], subject_code, today, 'present', None, counter.get('absences_counted', False)
+        )
         
-        # Get total enrolled student count
-        enrolled_count = students.count_documents({'subjects': subject_code})
+        # Push the scan to the teacher's live feed
+        if not SSE_CHANGE_STREAM:
+            attendance_events.publish(*build_attendance_event(
+                dict(attendance_key, **attendance_record),
+                today_count
+            ))
+        enrolled_count = get_enrolled_count(subject_code)
         
         return jsonify({
             'message': 'Attendance marked successfully',
             'record': {
-                'date': current_time.strftime('%Y-%m-%d'),
+                'date': today,
                 'subject': subject_name,
                 'status': 'present',
-                'time': current_time.strftime('%H:%M:%S')
+                'time': attendance_record['time']
             },
             'stats': {
                 'total_marked': today_count,
@@ -689,10 +1315,336 @@ def mark_attendance():
             }
         }), 200
     except Exception as e:
-        print(f"Error marking attendance: {str(e)}")
+        log_event('mark_attendance_failed', logging.ERROR, exc_info=True, error=str(e))
         return jsonify({'error': f'Failed to process QR code: {str(e)}'}), 400
 
-@app.route('/api/attendance/data', methods=['GET'])
+@api.route('/api/teacher/attendance/bulk', methods=['POST'])
+@authenticate_token
+def bulk_mark_attendance():
+    # Check if user is a teacher
+    if request.role != 'teacher':
+        return jsonify({'error': 'Access denied. This endpoint is for teachers only.'}), 403
+    
+    data = request.get_json() or {}
+    subject_code = data.get('subject_code')
+    entries = data.get('entries')
+    ordered = bool(data.get('ordered', False))
+    now = datetime.datetime.utcnow()
+    date = data.get('date') or now.strftime('%Y-%m-%d')
+    
+    # Validate input
+    if not subject_code:
+        return jsonify({'error': 'Missing required field: subject_code'}), 400
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'entries must be a non-empty list'}), 400
+    if len(entries) > MAX_BULK_ATTENDANCE:
+        return jsonify({'error': f'At most {MAX_BULK_ATTENDANCE} entries per request'}), 400
+    try:
+        record_day = datetime.datetime.strptime(date, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return jsonify({'error': 'date must be in YYYY-MM-DD format'}), 400
+    # Store the canonical form so '2026-10-1' and '2026-10-01' key the same day
+    date = record_day.strftime('%Y-%m-%d')
+    if record_day.date() > now.date():
+        return jsonify({'error': 'Cannot mark attendance for a future date'}), 400
+    
+    # Get teacher info
+    teacher = get_teacher_by_user(request.user_id)
+    if not teacher:
+        return jsonify({'error': 'Teacher profile not found'}), 404
+    if subject_code not in teacher['subjects']:
+        return jsonify({'error': f"Teacher does not teach subject '{subject_code}'"}), 403
+    
+    # Resolve every entry against the cached roster before touching attendance
+    roster = get_roster(subject_code)
+    roster_by_prn = None
+    results = []
+    wanted = {}
+    for index, entry in enumerate(entries):
+        entry = entry if isinstance(entry, dict) else {}
+        result = {'index': index, 'student_id': entry.get('student_id'), 'prn': entry.get('prn')}
+        results.append(result)
+        status = entry.get('status')
+        student = roster.get(str(entry.get('student_id')))
+        if student is None and entry.get('prn'):
+            if roster_by_prn is None:
+                roster_by_prn = {student['prn']: student for student in roster.values()}
+            student = roster_by_prn.get(entry['prn'])
+        
+        if status not in ('present', 'absent'):
+            result.update(result='error', error="status must be 'present' or 'absent'")
+        elif student is None:
+            result.update(result='error', error=f'Student is not enrolled in {subject_code}')
+        elif student['_id'] in wanted:
+            result.update(result='error', error='Student appears more than once')
+        else:
+            result.update(student_id=str(student['_id']), prn=student['prn'], status=status)
+            wanted[student['_id']] = (index, student, status)
+    
+    # One read tells which entries change anything, so unchanged ones cost no writes
+    existing = {
+        record['student_id']: record['status']
+        for record in attendance_records.find(
+            {'subject_code': subject_code, 'date': date, 'student_id': {'$in': list(wanted)}},
+            {'_id': 0, 'student_id': 1, 'status': 1}
+        )
+    } if wanted else {}
+    
+    subject_name = subject_catalog.name(subject_code)
+    timestamp = datetime.datetime.combine(record_day.date(), now.time())
+    operations = []
+    changes = []
+    for student_id, (index, student, status) in wanted.items():
+        previous = existing.get(student_id)
+        if previous == status:
+            results[index]['result'] = 'unchanged'
+            continue
+        operations.append(UpdateOne(
+            {'student_id': student_id, 'subject_code': subject_code, 'date': date},
+            {
+                '$set': {
+                    'status': status,
+                    'marked_by': str(teacher['_id']),
+                    'updated_at': now
+                },
+                '$setOnInsert': {
+                    'student_name': student['name'],
+                    'student_prn': student['prn'],
+                    'department': student['department'],
+                    'year': student['year'],
+                    'subject_name': subject_name,
+                    'time': now.strftime('%H:%M:%S'),
+                    'timestamp': timestamp,
+                    'teacher_id': str(teacher['_id']),
+                    'teacher_name': teacher['name'],
+                    'source': 'manual'
+                }
+            },
+            upsert=True
+        ))
+        changes.append((index, student_id, status, previous))
+        results[index]['result'] = 'updated' if previous else 'created'
+    
+    # Apply every change in one round trip; the unique (student, subject, date)
+    # index makes each upsert idempotent
+    failed = {}
+    if operations:
+        try:
+            attendance_records.bulk_write(operations, ordered=ordered)
+        except BulkWriteError as e:
+            failed = {error['index']: error.get('errmsg', 'Write failed') for error in e.details['writeErrors']}
+            if ordered and failed:
+                # An ordered batch stops at the first error
+                first = min(failed)
+                for position in range(first + 1, len(operations)):
+                    failed.setdefault(position, 'Not applied after an earlier error')
+    
+    # Keep the live counters and rollups in step with the students who became present or absent
+    applied = []
+    present_delta = 0
+    for position, (index, student_id, status, previous) in enumerate(changes):
+        if position in failed:
+            results[index].update(result='error', error=failed[position])
+            continue
+        applied.append((student_id, status, previous))
+        present_delta += (status == 'present') - (previous == 'present')
+    
+    if applied:
+        counter = attendance_counter_store.increment_state(subject_code, date, present_delta)
+        attendance_rollup_store.record_changes([
+            (student_id, subject_code, date, status, previous, counter.get('absences_counted', False))
+            for student_id, status, previous in applied
+        ])
+    invalidate_attendance_status(subject_code, date)
+    
+    summary = {
+        outcome: sum(1 for result in results if result['result'] == outcome)
+        for outcome in ('created', 'updated', 'unchanged', 'error')
+    }
+    return jsonify({
+        'subject_code': subject_code,
+        'date': date,
+        'summary': summary,
+        'results': results
+    }), 200
+
+@api.route('/api/attendance/sync', methods=['POST'])
+@authenticate_token
+def sync_attendance():
+    # Scans captured offline by a device; retrying an upload with the same nonces is harmless
+    
+    # Check if user is a student
+    if request.role != 'student':
+        return jsonify({'error': 'Access denied. This endpoint is for students only.'}), 403
+    
+    data = request.get_json() or {}
+    scans = data.get('scans')
+    if not isinstance(scans, list) or not scans:
+        return jsonify({'error': 'scans must be a non-empty list'}), 400
+    if len(scans) > MAX_SYNC_SCANS:
+        return jsonify({'error': f'At most {MAX_SYNC_SCANS} scans per request'}), 400
+    
+    student = get_student(request.user_id)
+    if not student:
+        return jsonify({'error': 'Student profile not found'}), 404
+    
+    now = datetime.datetime.utcnow()
+    results = []
+    candidates = []
+    for index, scan in enumerate(scans):
+        scan = scan if isinstance(scan, dict) else {}
+        nonce = scan.get('nonce')
+        result = {'index': index, 'nonce': nonce}
+        results.append(result)
+        scanned_at = parse_scan_time(scan.get('scanned_at'))
+        
+        if not isinstance(nonce, str) or not 0 < len(nonce) <= 64:
+            result.update(result='rejected', error='nonce must be a string of up to 64 characters')
+            continue
+        if scanned_at is None:
+            result.update(result='rejected', error='scanned_at must be epoch seconds or an ISO 8601 time')
+            continue
+        if scanned_at > now + datetime.timedelta(seconds=SYNC_CLOCK_SKEW_SECONDS):
+            result.update(result='rejected', error='Scan time is in the future')
+            continue
+        if now - scanned_at > datetime.timedelta(seconds=SYNC_MAX_AGE_SECONDS):
+            result.update(result='rejected', error='Scan is too old to sync')
+            continue
+        
+        # The code must have been valid at the moment it was scanned, not at upload time
+        scan_epoch = calendar.timegm(scanned_at.utctimetuple())
+        try:
+            qr_claims = verify_qr_token(QR_SECRET_KEY, scan.get('qr_data'), now=scan_epoch)
+        except ExpiredQRCode:
+            result.update(result='rejected', error='QR code had expired when scanned')
+            continue
+        except InvalidQRCode:
+            result.update(result='rejected', error='Invalid QR code format')
+            continue
+        if scan_epoch < qr_claims['expires_at'] - QR_VALID_SECONDS - SYNC_CLOCK_SKEW_SECONDS:
+            result.update(result='rejected', error='Scan time is before the QR code was shown')
+            continue
+        if qr_claims['subject_code'] not in student['subjects']:
+            result.update(result='rejected', error=f"You are not enrolled in {subject_catalog.name(qr_claims['subject_code'])}")
+            continue
+        
+        attendance_key, attendance_record = build_attendance_record(student, qr_claims, scanned_at)
+        result.update(subject_code=attendance_key['subject_code'], date=attendance_key['date'])
+        candidates.append({
+            'slot': (attendance_key['subject_code'], attendance_key['date']),
+            'index': index,
+            'nonce': nonce,
+            'scanned_at': scanned_at,
+            'claims': qr_claims,
+            'key': attendance_key,
+            'record': attendance_record
+        })
+    
+    # Scans are only good within their class session, up to an early close
+    session_ids = {ObjectId(scan['claims']['session_id']) for scan in candidates}
+    sessions = {
+        str(session['_id']): session
+        for session in class_sessions.find(
+            {'_id': {'$in': list(session_ids)}},
+            {'started_at': 1, 'expires_at': 1, 'closed_at': 1}
+        )
+    } if session_ids else {}
+    
+    # Several scans of one class in a batch keep the earliest; the same nonce twice is one scan
+    accepted = {}
+    for scan in candidates:
+        session = sessions.get(scan['claims']['session_id'])
+        ended_at = session and (session.get('closed_at') or session['expires_at'])
+        if not session or not session['started_at'] <= scan['scanned_at'] <= ended_at:
+            results[scan['index']].update(result='rejected', error='Invalid or inactive QR code')
+            continue
+        earlier = accepted.get(scan['slot'])
+        if earlier is not None:
+            if earlier['nonce'] == scan['nonce'] or earlier['scanned_at'] <= scan['scanned_at']:
+                results[scan['index']].update(result='duplicate', duplicate_of=earlier['index'])
+                continue
+            results[earlier['index']].update(result='duplicate', duplicate_of=scan['index'])
+        accepted[scan['slot']] = scan
+    
+    # A retried upload finds its own nonce on the stored record
+    existing = {
+        (record['subject_code'], record['date']): record.get('client_nonce')
+        for record in attendance_records.find(
+            {'student_id': student['_id'], '$or': [{'subject_code': code, 'date': date} for code, date in accepted]},
+            {'_id': 0, 'subject_code': 1, 'date': 1, 'client_nonce': 1}
+        )
+    } if accepted else {}
+    pending = []
+    for key, scan in accepted.items():
+        if key in existing:
+            results[scan['index']]['result'] = 'marked' if existing[key] == scan['nonce'] else 'already_marked'
+        else:
+            pending.append(scan)
+    
+    # Persist every new scan in one round trip
+    inserted = set()
+    if pending:
+        operations = [
+            UpdateOne(
+                scan['key'],
+                {'$setOnInsert': dict(scan['record'], client_nonce=scan['nonce'], source='offline_sync', synced_at=now)},
+                upsert=True
+            )
+            for scan in pending
+        ]
+        try:
+            upserted = attendance_records.bulk_write(operations, ordered=False).upserted_ids
+        except BulkWriteError as e:
+            # Duplicate keys mean a concurrent upload or live scan won the insert
+            upserted = {item['index']: item['_id'] for item in e.details.get('upserted', [])}
+        inserted = set(upserted)
+        
+        # Lost races are settled by whoever stored the record
+        raced = [scan for position, scan in enumerate(pending) if position not in inserted]
+        if raced:
+            stored = {
+                (record['subject_code'], record['date']): record.get('client_nonce')
+                for record in attendance_records.find(
+                    {'student_id': student['_id'], '$or': [scan['key'] for scan in raced]},
+                    {'_id': 0, 'subject_code': 1, 'date': 1, 'client_nonce': 1}
+                )
+            }
+            for scan in raced:
+                results[scan['index']]['result'] = 'marked' if stored.get(scan['slot']) == scan['nonce'] else 'already_marked'
+    
+    # Bookkeeping for the newly stored scans, as mark_attendance does for live ones
+    new_scans = [pending[position] for position in sorted(inserted)]
+    new_counts = {}
+    for scan in new_scans:
+        results[scan['index']]['result'] = 'marked'
+        new_counts[scan['slot']] = new_counts.get(scan['slot'], 0) + 1
+        session_stat_writes.add(UpdateOne(
+            {'_id': ObjectId(scan['claims']['session_id'])},
+            {'$inc': {'marked_attendance_count': 1}}
+        ))
+    counters = {}
+    for (subject_code, date), count in new_counts.items():
+        counters[(subject_code, date)] = attendance_counter_store.increment_state(subject_code, date, count)
+        invalidate_attendance_status(subject_code, date)
+    attendance_rollup_store.record_changes([
+        (student['_id'], scan['slot'][0], scan['slot'][1], 'present', None,
+         counters[scan['slot']].get('absences_counted', False))
+        for scan in new_scans
+    ])
+    if not SSE_CHANGE_STREAM:
+        for scan in new_scans:
+            attendance_events.publish(*build_attendance_event(
+                dict(scan['key'], **scan['record']),
+                counters[scan['slot']]['marked']
+            ))
+    
+    summary = {
+        outcome: sum(1 for result in results if result['result'] == outcome)
+        for outcome in ('marked', 'already_marked', 'duplicate', 'rejected')
+    }
+    return jsonify({'summary': summary, 'results': results}), 200
+
+@api.route('/api/attendance/data', methods=['GET'])
 @authenticate_token
 def get_attendance_data():
     # Check if user is a student
@@ -700,7 +1652,7 @@ def get_attendance_data():
         return jsonify({'error': 'Access denied. This endpoint is for students only.'}), 403
     
     # Get student info
-    student = students.find_one({'user_id': ObjectId(request.user_id)})
+    student = get_student(request.user_id)
     if not student:
         return jsonify({'error': 'Student profile not found'}), 404
     
@@ -714,68 +1666,55 @@ def get_attendance_data():
     if not end_date:
         end_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
     
-    # Build query for attendance records
-    query = {
+    match = {
         'student_id': student['_id'],
         'date': {'$gte': start_date, '$lte': end_date}
     }
     
-    # Get attendance records
-    records = list(attendance_records.find(query).sort('timestamp', -1))
+    # Optional keyset pagination on (timestamp, _id) and incremental streaming
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        after = decode_cursor(request.args['after'], 2) if request.args.get('after') else None
+        if after:
+            after = (datetime.datetime.fromisoformat(after[0]), ObjectId(after[1]))
+    except (ValueError, InvalidCursor, InvalidId):
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    stream = request.args.get('stream', '').lower() in ('true', '1', 't')
     
-    # Calculate statistics
-    total_classes = 0
-    present_count = 0
-    by_subject = {}
+    # Subject summaries come from the monthly rollups for whole months in the range and
+    # from raw records only for the partial months at either end
+    try:
+        subject_groups = attendance_rollup_store.range_summaries(
+            student['_id'], student['subjects'], start_date, end_date
+        )
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    overall, by_subject = summarize_attendance(student, subject_groups)
     
-    # Create a dictionary of all subjects enrolled
-    for subject_code in student['subjects']:
-        subject = subjects.find_one({'code': subject_code})
-        subject_name = subject['name'] if subject else subject_code
-        by_subject[subject_name] = {'present': 0, 'total': 0}
-    
-    # Process attendance records
-    formatted_records = []
-    for record in records:
-        # Convert ObjectId to string
-        record['_id'] = str(record['_id'])
-        record['student_id'] = str(record['student_id'])
-        if 'qr_code_id' in record:
-            record['qr_code_id'] = str(record['qr_code_id'])
-        
-        # Get subject name
-        subject = subjects.find_one({'code': record['subject_code']})
-        subject_name = subject['name'] if subject else record['subject_code']
-        
-        # Update statistics
-        total_classes += 1
-        if record['status'] == 'present':
-            present_count += 1
-            by_subject[subject_name]['present'] += 1
-        by_subject[subject_name]['total'] += 1
-        
-        # Format record for frontend
-        formatted_record = {
-            'date': f"{record['date']}T{record['time']}Z",
-            'subject': subject_name,
-            'status': record['status'],
-            'time': record['time']
-        }
-        formatted_records.append(formatted_record)
+    # Records are read page by page from a cursor
+    record_query = dict(match)
+    if after:
+        record_query['$or'] = [
+            {'timestamp': {'$lt': after[0]}},
+            {'timestamp': after[0], '_id': {'$lt': after[1]}}
+        ]
+    cursor = attendance_records.find(
+        record_query,
+        {'subject_code': 1, 'status': 1, 'date': 1, 'time': 1, 'timestamp': 1}
+    ).sort([('timestamp', -1), ('_id', -1)]).batch_size(STREAM_BATCH_SIZE)
+    page = KeysetPage(cursor, limit, key=lambda record: (record['timestamp'].isoformat(), record['_id']))
     
-    # Prepare response
-    response = {
-        'overall': {
-            'present': present_count,
-            'total': total_classes
-        },
-        'bySubject': by_subject,
-        'records': formatted_records
-    }
+    head = {'overall': overall, 'bySubject': by_subject}
+    if stream:
+        return stream_json_response(head, 'records', map(format_attendance_record, page), tail=lambda: {'next': page.next})
+    
+    response = dict(head, records=[format_attendance_record(record) for record in page])
+    if limit is not None or after is not None:
+        response['next'] = page.next
     
     return jsonify(response), 200
 
-@app.route('/api/teacher/attendance/status', methods=['GET'])
+@api.route('/api/teacher/attendance/status', methods=['GET'])
 @authenticate_token
 def get_attendance_status():
     # Check if user is a teacher
@@ -791,7 +1730,7 @@ def get_attendance_status():
         return jsonify({'error': 'Subject code is required'}), 400
     
     # Get teacher info
-    teacher = teachers.find_one({'user_id': ObjectId(request.user_id)})
+    teacher = get_teacher_by_user(request.user_id)
     if not teacher:
         return jsonify({'error': 'Teacher profile not found'}), 404
     
@@ -799,52 +1738,165 @@ def get_attendance_status():
     if subject_code not in teacher['subjects']:
         return jsonify({'error': 'You are not authorized to view attendance for this subject'}), 403
     
-    # Get all students enrolled in this subject
-    enrolled_students = list(students.find({'subjects': subject_code}))
+    return jsonify(get_attendance_status_cached(subject_code, date)), 200
+
+@api.route('/api/admin/attendance/export', methods=['GET'])
+@authenticate_token
+def export_attendance():
+    # Check if user is an admin
+    if request.role != 'admin':
+        return jsonify({'error': 'Access denied. This endpoint is for admins only.'}), 403
     
-    # Get attendance records for the specified date and subject
-    attendance_query = {
-        'subject_code': subject_code,
-        'date': date
-    }
+    # Get query parameters
+    department = request.args.get('department')
+    year = request.args.get('year')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    subject_codes = request.args.getlist('subject_code')
+    compress = request.args.get('gzip', '').lower() in ('true', '1', 't')
     
-    attendance_list = list(attendance_records.find(attendance_query))
+    # Validate input
+    if not start_date or not end_date:
+        return jsonify({'error': 'start_date and end_date are required'}), 400
+    try:
+        datetime.datetime.strptime(start_date, '%Y-%m-%d')
+        datetime.datetime.strptime(end_date, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
     
-    # Create a lookup of present students
-    present_students = {str(record['student_id']): True for record in attendance_list}
+    student_query = {}
+    if department:
+        student_query['department'] = department
+    if year:
+        try:
+            student_query['year'] = int(year)
+        except ValueError:
+            return jsonify({'error': 'year must be a number'}), 400
     
-    # Prepare response
-    response = {
-        'date': date,
-        'subject_code': subject_code,
-        'total_students': len(enrolled_students),
-        'present_count': len(attendance_list),
-        'absent_count': len(enrolled_students) - len(attendance_list),
-        'attendance_percentage': round(len(attendance_list) / len(enrolled_students) * 100) if enrolled_students else 0,
-        'students': []
-    }
+    # Resume after the student_id in the first column of the last row received
+    try:
+        after = ObjectId(request.args['after']) if request.args.get('after') else None
+    except InvalidId:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
     
-    # Add student details
-    for student in enrolled_students:
-        student_id = str(student['_id'])
-        status = 'present' if student_id in present_students else 'absent'
-        
-        student_info = {
-            'id': student_id,
-            'name': student['name'],
-            'prn': student['prn'],
-            'department': student['department'],
-            'year': student['year'],
-            'status': status
-        }
-        
-        response['students'].append(student_info)
+    export = AttendanceExport(
+        students, attendance_records, attendance_counters, student_query, start_date, end_date,
+        subject_codes=subject_codes or None, after=after,
+        batch_size=EXPORT_BATCH_SIZE, chunk_size=EXPORT_CHUNK_STUDENTS
+    )
     
-    return jsonify(response), 200
+    def generate():
+        completed = False
+        try:
+            yield from export.iter_csv(compress=compress, header=after is None)
+            completed = True
+        finally:
+            log_event(
+                'attendance_export_finished' if completed else 'attendance_export_aborted',
+                department=department, start_date=start_date, end_date=end_date,
+                columns=len(export.columns or []), rows=export.rows_written,
+                rows_per_second=round(export.rows_per_second, 1),
+                last_student_id=export.last_student_id
+            )
+    
+    filename = f"attendance-{department or 'all'}-{start_date}-{end_date}.csv" + ('.gz' if compress else '')
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/gzip' if compress else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"', 'X-Accel-Buffering': 'no'}
+    )
+
+def load_department_matrix():
+    """Presence matrix for the department and date range in the query string, or an error response"""
+    department = request.args.get('department')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    if not department or not start_date or not end_date:
+        return None, (jsonify({'error': 'department, start_date and end_date are required'}), 400)
+    try:
+        datetime.datetime.strptime(start_date, '%Y-%m-%d')
+        datetime.datetime.strptime(end_date, '%Y-%m-%d')
+    except ValueError:
+        return None, (jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400)
+    try:
+        return department_analytics.matrix(department, start_date, end_date), None
+    except AnalyticsUnavailable as e:
+        return None, (jsonify({'error': str(e)}), 503)
+
+@api.route('/api/admin/analytics/defaulters', methods=['GET'])
+@authenticate_token
+def get_defaulters():
+    # Check if user is an admin
+    if request.role != 'admin':
+        return jsonify({'error': 'Access denied. This endpoint is for admins only.'}), 403
+    
+    try:
+        threshold = float(request.args.get('threshold', DEFAULTER_THRESHOLD))
+    except ValueError:
+        return jsonify({'error': 'threshold must be a number'}), 400
+    
+    matrix, error = load_department_matrix()
+    if error:
+        return error
+    
+    defaulters = matrix.defaulters(threshold)
+    return jsonify({
+        'department': request.args['department'],
+        'threshold': threshold,
+        'students': len(matrix.students),
+        'class_days': len(matrix.sessions),
+        'defaulters': defaulters
+    }), 200
 
-@app.route('/')
+@api.route('/api/admin/analytics/heatmap', methods=['GET'])
+@authenticate_token
+def get_attendance_heatmap():
+    # Check if user is an admin
+    if request.role != 'admin':
+        return jsonify({'error': 'Access denied. This endpoint is for admins only.'}), 403
+    
+    by = request.args.get('by', 'weekday')
+    if by not in HEATMAP_GROUPS:
+        return jsonify({'error': f"by must be one of {', '.join(HEATMAP_GROUPS)}"}), 400
+    
+    matrix, error = load_department_matrix()
+    if error:
+        return error
+    
+    return jsonify(dict(matrix.heatmap(by), department=request.args['department'], by=by)), 200
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@api.route('/')
 def index():
     return jsonify({"message": "Welcome to AttendMax API"})
 
+def create_app():
+    """Build the Flask application; no database I/O happens until it is first needed"""
+    app = Flask(__name__)
+    CORS(app)
+    configure_logging(LOG_LEVEL, LOG_SAMPLE_RATES, LOG_RATE_LIMITS, LOG_QUEUE_SIZE)
+    init_request_ids(app)
+    app.register_blueprint(api)
+    request_timing.init_app(app)
+    request_metrics.init_app(app)
+    
+    @app.before_request
+    def check_indexes_once():
+        # Held for the life of the process, so only the first request starts the check
+        if INDEX_CHECK_ON_START and index_check_started.acquire(blocking=False):
+            threading.Thread(target=report_index_drift, name='index-check', daemon=True).start()
+    
+    @app.cli.command('bootstrap')
+    def bootstrap_command():
+        """Create indexes and seed sample data"""
+        bootstrap()
+    
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
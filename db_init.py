@@ -8,13 +8,21 @@ from dotenv import load_dotenv
 import os
 import datetime
 from werkzeug.security import generate_password_hash
+from services.catalog import ACCOUNTS_ID, bump_catalog_version
+from services.counters import AttendanceCounters
+from services.rollups import AttendanceRollups
+from services.indexes import application_indexes
 import sys
+import zlib
+from bson import ObjectId
 
 # Load environment variables
 load_dotenv()
 
 # MongoDB Atlas connection string
 MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/attendmax')
+# Must match the app's setting, or the TTL indexes built here differ from its registry
+CLASS_SESSION_RETENTION_SECONDS = int(os.environ.get('CLASS_SESSION_RETENTION_SECONDS', 86400))
 
 def init_db():
     """Initialize the database with sample data"""
@@ -50,17 +58,13 @@ def init_db():
             departments.delete_many({})
             subjects.delete_many({})
             attendance_records.delete_many({})
+            db['attendance_counters'].delete_many({})
+            db['attendance_rollups'].delete_many({})
             qr_codes.delete_many({})
             print("Existing data cleared")
         
         # Create indexes
-        users.create_index('email', unique=True)
-        users.create_index('username', unique=True)
-        students.create_index('prn', unique=True)
-        students.create_index('email', unique=True)
-        teachers.create_index('email', unique=True)
-        departments.create_index('code', unique=True)
-        subjects.create_index([('code', 1), ('department', 1)], unique=True)
+        application_indexes(CLASS_SESSION_RETENTION_SECONDS).sync(db)
         print("Indexes created")
         
         # Initialize departments
@@ -84,6 +88,8 @@ def init_db():
             {'name': 'Thermodynamics', 'code': 'ME101', 'department': 'ME', 'year': 2, 'credits': 4}
         ]
         subjects.insert_many(sample_subjects)
+        # Tell running servers to reload their subject catalog
+        bump_catalog_version(db['catalog_meta'])
         print("Subjects created")
         
         # Create admin user
@@ -214,6 +220,19 @@ def init_db():
         # Create sample attendance records for the past 30 days
         generate_sample_attendance(db, students, subjects)
         
+        # Class days for exports and analytics come from the per-day counters
+        AttendanceCounters(db['attendance_counters'], attendance_records).reconcile()
+        print("Attendance counters built")
+        
+        # Build the monthly summaries the student dashboard reads
+        AttendanceRollups(
+            db['attendance_rollups'], attendance_records, db['attendance_counters'], students
+        ).rebuild()
+        print("Attendance rollups built")
+        
+        # Tell running servers to drop their cached users and student profiles
+        bump_catalog_version(db['catalog_meta'], ACCOUNTS_ID)
+        
         print("\nDatabase initialization completed successfully!")
         print("\nYou can now log in with the following accounts:")
         print("\nStudent Accounts:")
@@ -239,15 +258,20 @@ def is_fresh_install(db):
         db.teachers.count_documents({}) == 0
     )
 
+def sample_bucket(key, buckets=100):
+    """Deterministic bucket for a key; unlike hash() it is stable across runs"""
+    return zlib.crc32(key.encode()) % buckets
+
 def generate_sample_attendance(db, students_list, subjects_list):
     """Generate sample attendance records for the past 30 days"""
     attendance_records = db['attendance_records']
-    qr_codes = db['qr_codes']
     
     # Get all students and subjects from the database
     students_db = list(db.students.find({}))
     subjects_db = list(db.subjects.find({}))
     
+    records = []
+    
     # Generate records for the past 30 days
     for day_offset in range(30, 0, -1):
         # Skip weekends (5=Saturday, 6=Sunday)
@@ -257,27 +281,22 @@ def generate_sample_attendance(db, students_list, subjects_list):
         
         date_str = record_date.strftime('%Y-%m-%d')
         
+        # One mock class session per subject and day
+        session_ids = {}
+        
         # For each student
         for student in students_db:
             # For each subject the student is enrolled in
             for subject_code in student['subjects']:
                 # 80% chance of being present
-                is_present = (hash(f"{student['prn']}:{subject_code}:{date_str}") % 100) < 80
+                is_present = sample_bucket(f"{student['prn']}:{subject_code}:{date_str}") < 80
                 
                 # Only create attendance record if present
                 if is_present:
-                    # Create a mock QR code record
-                    qr_data = {
-                        'teacher_id': 'mock_teacher',
-                        'subject_code': subject_code,
-                        'generated_at': record_date,
-                        'expires_at': record_date + datetime.timedelta(minutes=10),
-                        'is_active': False  # Historical QR code, no longer active
-                    }
-                    qr_id = qr_codes.insert_one(qr_data).inserted_id
+                    session_id = session_ids.setdefault(subject_code, ObjectId())
                     
                     # Create attendance record
-                    time_str = "09:30:00" if hash(f"{subject_code}:{date_str}") % 2 == 0 else "14:30:00"
+                    time_str = "09:30:00" if sample_bucket(f"{subject_code}:{date_str}", 2) == 0 else "14:30:00"
                     record_datetime = datetime.datetime.fromisoformat(f"{date_str}T{time_str}")
                     
                     attendance_record = {
@@ -287,14 +306,17 @@ def generate_sample_attendance(db, students_list, subjects_list):
                         'department': student['department'],
                         'year': student['year'],
                         'subject_code': subject_code,
-                        'qr_code_id': qr_id,
+                        'session_id': session_id,
                         'status': 'present',
                         'date': date_str,
                         'time': time_str,
                         'timestamp': record_datetime
                     }
                     
-                    attendance_records.insert_one(attendance_record)
+                    records.append(attendance_record)
+    
+    if records:
+        attendance_records.insert_many(records)
     
     print(f"Generated sample attendance records for the past 30 days")
 
@@ -8,7 +8,12 @@ from dotenv import load_dotenv
 import os
 import datetime
 from werkzeug.security import generate_password_hash
+from services.catalog import ACCOUNTS_ID, bump_catalog_version
+from services.counters import AttendanceCounters
+from services.rollups import AttendanceRollups
+from services.indexes import application_indexes
 import random
+from bson import ObjectId
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +23,11 @@ MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/attendmax')
 # Replace /attendmax with /Attendmax to match existing case
 if '/attendmax' in MONGO_URI:
     MONGO_URI = MONGO_URI.replace('/attendmax', '/Attendmax')
+# Must match the app's setting, or the TTL indexes built here differ from its registry
+CLASS_SESSION_RETENTION_SECONDS = int(os.environ.get('CLASS_SESSION_RETENTION_SECONDS', 86400))
+
+# Seed for the sample attendance records
+SAMPLE_SEED = 42
 
 def main():
     try:
@@ -39,6 +49,8 @@ def main():
         db.departments.drop()
         db.subjects.drop()
         db.attendance_records.drop()
+        db.attendance_counters.drop()
+        db.attendance_rollups.drop()
         db.qr_codes.drop()
         
         # Create departments
@@ -63,6 +75,8 @@ def main():
             {'name': 'Thermodynamics', 'code': 'ME101', 'department': 'ME', 'year': 2, 'credits': 4}
         ]
         db.subjects.insert_many(subjects)
+        # Tell running servers to reload their subject catalog
+        bump_catalog_version(db.catalog_meta)
         
         # Create admin
         print("Creating admin user...")
@@ -207,6 +221,10 @@ def main():
         print("Creating sample attendance records...")
         student_records = list(db.students.find())
         
+        # A fixed seed keeps the sample data identical between runs
+        rng = random.Random(SAMPLE_SEED)
+        records = []
+        
         # Generate attendance for the last 30 days
         for day in range(30, 0, -1):
             date = (datetime.datetime.now() - datetime.timedelta(days=day)).strftime('%Y-%m-%d')
@@ -215,25 +233,20 @@ def main():
             weekday = datetime.datetime.strptime(date, '%Y-%m-%d').weekday()
             if weekday >= 5:  # 5 = Saturday, 6 = Sunday
                 continue
+            
+            # One mock class session per subject and day
+            session_ids = {}
                 
             for student in student_records:
                 for subject_code in student['subjects']:
                     # 80% chance of being present
-                    is_present = random.random() < 0.8
+                    is_present = rng.random() < 0.8
                     
                     if is_present:
-                        # Create a mock QR code
-                        qr_code = {
-                            'teacher_id': 'mock_teacher',
-                            'subject_code': subject_code,
-                            'generated_at': datetime.datetime.strptime(date, '%Y-%m-%d'),
-                            'expires_at': datetime.datetime.strptime(date, '%Y-%m-%d') + datetime.timedelta(minutes=10),
-                            'is_active': False
-                        }
-                        qr_id = db.qr_codes.insert_one(qr_code).inserted_id
+                        session_id = session_ids.setdefault(subject_code, ObjectId())
                         
                         # Create attendance record
-                        time = "09:30:00" if random.random() < 0.5 else "14:30:00"
+                        time = "09:30:00" if rng.random() < 0.5 else "14:30:00"
                         record = {
                             'student_id': student['_id'],
                             'student_name': student['name'],
@@ -241,22 +254,32 @@ def main():
                             'department': student['department'],
                             'year': student['year'],
                             'subject_code': subject_code,
-                            'qr_code_id': qr_id,
+                            'session_id': session_id,
                             'status': 'present',
                             'date': date,
                             'time': time,
                             'timestamp': datetime.datetime.strptime(f"{date}T{time}", '%Y-%m-%dT%H:%M:%S')
                         }
                         
-                        db.attendance_records.insert_one(record)
+                        records.append(record)
+        
+        if records:
+            db.attendance_records.insert_many(records)
+        
+        # Class days for exports and analytics come from the per-day counters
+        AttendanceCounters(db.attendance_counters, db.attendance_records).reconcile()
+        
+        # Build the monthly summaries the student dashboard reads
+        AttendanceRollups(
+            db.attendance_rollups, db.attendance_records, db.attendance_counters, db.students
+        ).rebuild()
         
         # Create indexes
         print("Creating database indexes...")
-        db.users.create_index('email', unique=True)
-        db.users.create_index('username', unique=True)
-        db.students.create_index('prn', unique=True)
-        db.students.create_index('email', unique=True)
-        db.teachers.create_index('email', unique=True)
+        application_indexes(CLASS_SESSION_RETENTION_SECONDS).sync(db)
+        
+        # Tell running servers to drop their cached users and student profiles
+        bump_catalog_version(db.catalog_meta, ACCOUNTS_ID)
         
         print("\nDatabase setup complete! You can now use the following accounts:")
         print("\nStudent Accounts:")
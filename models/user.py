@@ -1,6 +1,6 @@
 from datetime import datetime
 from flask_mongoengine import MongoEngine
-from werkzeug.security import generate_password_hash, check_password_hash
+from services.passwords import hash_password, verify_password
 
 # This will be initialized in app.py
 db = MongoEngine()
@@ -26,7 +26,7 @@ class User(db.Document):
     @staticmethod
     def create_user(username, email, password, role='student', registered_ip=None):
         """Create a new user with hashed password"""
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
         user = User(
             username=username,
             email=email,
@@ -40,7 +40,7 @@ class User(db.Document):
     
     def check_password(self, password):
         """Check if provided password matches stored hash"""
-        return check_password_hash(self.password, password)
+        return verify_password(self.password, password)
     
     def to_json(self):
         """Convert user to JSON representation (excluding password)"""
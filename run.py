@@ -5,7 +5,7 @@ Run script for the AttendMax API server
 from dotenv import load_dotenv
 import os
 import sys
-from app import app
+from app import app, bootstrap
 from db_init import init_db
 
 # Load environment variables
@@ -14,6 +14,10 @@ load_dotenv()
 if __name__ == '__main__':
     # Check for command line arguments
     if len(sys.argv) > 1:
+        if sys.argv[1] == '--bootstrap':
+            # Create indexes and seed sample accounts, then exit
+            bootstrap()
+            sys.exit(0)
         if sys.argv[1] == '--init-db':
             # Initialize database with sample data
             print("Initializing database with sample data...")
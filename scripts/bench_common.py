@@ -0,0 +1,109 @@
+"""
+Shared scaffolding for the benchmark and load test scripts
+
+Importing this module registers a MongoDB command counter and then imports the
+app, so scripts take ``attendmax`` from here rather than importing app.py first.
+Scripts add the repository root to sys.path before importing it.
+"""
+import datetime
+import threading
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Count MongoDB commands in total and per thread, so each request sees only its own"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+    def started(self, event):
+        self.local.count = self.count() + 1
+        with self.lock:
+            self.total += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# The listener must be registered before app.py creates its MongoClient
+counter = CommandCounter()
+monitoring.register(counter)
+
+import app as attendmax
+
+
+class SyntheticClass:
+    """A throwaway subject, teacher and cohort of students, removed again by cleanup
+
+    For ``name='bench'`` the department is BENCH, the subject BENCH101 and the
+    accounts bench.teacher and bench.student<i> at @bench.invalid.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.department = name.upper()
+        self.subject = f'{self.department}101'
+        self.domain = f'{name}.invalid'
+
+    def teacher_email(self):
+        return f'{self.name}.teacher@{self.domain}'
+
+    def student_email(self, i):
+        return f'{self.name}.student{i}@{self.domain}'
+
+    def setup(self, student_count, password_hash='!'):
+        """Insert the class and return (teacher user id, student user ids)"""
+        now = datetime.datetime.utcnow()
+        label = self.name.title()
+        attendmax.subjects.insert_one({
+            'name': f'{label} Subject', 'code': self.subject, 'department': self.department, 'year': 1, 'credits': 0
+        })
+        attendmax.subject_catalog.invalidate()
+        teacher_user_id = attendmax.users.insert_one({
+            'username': f'{self.name}.teacher', 'email': self.teacher_email(), 'password': password_hash,
+            'role': 'teacher', 'created_at': now
+        }).inserted_id
+        attendmax.teachers.insert_one({
+            'name': f'{label} Teacher', 'email': self.teacher_email(), 'department': self.department,
+            'subjects': [self.subject], 'user_id': teacher_user_id, 'created_at': now
+        })
+        user_ids = attendmax.users.insert_many([
+            {
+                'username': f'{self.name}.student{i}', 'email': self.student_email(i), 'password': password_hash,
+                'role': 'student', 'created_at': now
+            }
+            for i in range(student_count)
+        ]).inserted_ids
+        attendmax.students.insert_many([
+            {
+                'name': f'{label} Student {i}', 'prn': f'{self.department}{i:05d}', 'email': self.student_email(i),
+                'department': self.department, 'year': 1, 'subjects': [self.subject], 'user_id': user_id,
+                'created_at': now
+            }
+            for i, user_id in enumerate(user_ids)
+        ])
+        return teacher_user_id, user_ids
+
+    def cleanup(self):
+        attendmax.attendance_records.delete_many({'subject_code': self.subject})
+        attendmax.attendance_counters.delete_many({'subject_code': self.subject})
+        attendmax.attendance_rollups.delete_many({'subject_code': self.subject})
+        attendmax.class_sessions.delete_many({'subject_code': self.subject})
+        attendmax.students.delete_many({'department': self.department})
+        attendmax.teachers.delete_many({'department': self.department})
+        attendmax.users.delete_many({'email': {'$regex': f'@{self.name}\\.invalid$'}})
+        attendmax.subjects.delete_many({'code': self.subject})
+        attendmax.subject_catalog.invalidate()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Benchmark for the mark_attendance hot path
+
+Creates a throwaway subject, teacher and cohort of students, warms each student's
+session with a profile request, has every student scan one QR code through the
+Flask test client and reports latency and MongoDB commands per scan. A warm scan
+should issue 3: the record upsert, the counter $inc and the rollup $inc. All
+benchmark documents are removed afterwards.
+
+Usage: python scripts/bench_mark_attendance.py [--students N]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import datetime
+import statistics
+import time
+import uuid
+import jwt
+from bench_common import SyntheticClass, attendmax, counter, percentile
+
+bench = SyntheticClass('bench')
+
+
+def make_token(user_id, role, username):
+    now = datetime.datetime.utcnow()
+    return jwt.encode(
+        {
+            'user_id': str(user_id),
+            'username': username,
+            'email': f'{username}@{bench.domain}',
+            'role': role,
+            'jti': uuid.uuid4().hex,
+            'iat': now,
+            'exp': now + datetime.timedelta(hours=1)
+        },
+        attendmax.JWT_SECRET_KEY,
+        algorithm='HS256'
+    )
+
+
+def setup(student_count):
+    teacher_user_id, user_ids = bench.setup(student_count)
+    teacher_token = make_token(teacher_user_id, 'teacher', 'bench.teacher')
+    student_tokens = [make_token(user_id, 'student', f'bench.student{i}') for i, user_id in enumerate(user_ids)]
+    return teacher_token, student_tokens
+
+
+def run(student_count):
+    # The already-marked path depends on the unique attendance index
+    attendmax.create_indexes()
+    bench.cleanup()
+    teacher_token, student_tokens = setup(student_count)
+    client = attendmax.app.test_client()
+    try:
+        response = client.post(
+            '/api/teacher/generate_qr',
+            json={'subject_code': bench.subject},
+            headers={'Authorization': f'Bearer {teacher_token}'}
+        )
+        qr_code = response.get_json()['qr_code']
+
+        # Students open their dashboard before scanning, as the client app does
+        for token in student_tokens:
+            client.get('/api/student/profile', headers={'Authorization': f'Bearer {token}'})
+
+        latencies = []
+        ops = []
+        for token in student_tokens:
+            headers = {'Authorization': f'Bearer {token}'}
+            before = counter.count()
+            started = time.perf_counter()
+            response = client.post('/api/attendance/mark', json={'qr_data': qr_code}, headers=headers)
+            latencies.append((time.perf_counter() - started) * 1000)
+            ops.append(counter.count() - before)
+            if response.status_code != 200:
+                print(f"Unexpected response {response.status_code}: {response.get_json()}")
+                return
+
+        # Every student scanning again must hit the already-marked path
+        before = counter.count()
+        duplicate = client.post(
+            '/api/attendance/mark', json={'qr_data': qr_code},
+            headers={'Authorization': f'Bearer {student_tokens[0]}'}
+        )
+        duplicate_ops = counter.count() - before
+
+        warm_ops = ops[1:] or ops
+        print(f"Scans: {len(latencies)}")
+        print(f"Latency ms: p50={percentile(latencies, 50):.2f} p95={percentile(latencies, 95):.2f} "
+              f"p99={percentile(latencies, 99):.2f} max={max(latencies):.2f}")
+        print(f"DB ops per scan: first={ops[0]} warm avg={statistics.mean(warm_ops):.2f} "
+              f"warm max={max(warm_ops)}")
+        print(f"DB ops for duplicate scan: {duplicate_ops} (status {duplicate.status_code})")
+    finally:
+        bench.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the mark_attendance hot path')
+    parser.add_argument('--students', type=int, default=200, help='number of students scanning')
+    args = parser.parse_args()
+    run(args.students)
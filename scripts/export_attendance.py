@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Export attendance as a student x class-day CSV, streamed straight from MongoDB
+
+Memory stays flat however many students are exported. Progress (rows and rows/s)
+goes to stderr. An interrupted export to a plain CSV file can be continued with
+--resume; for gzip output or stdout, start a new file with --after set to the
+student_id printed when the export stopped.
+
+Usage: python scripts/export_attendance.py --start-date YYYY-MM-DD --end-date YYYY-MM-DD
+           [--department CS] [--year 2] [--subject CS101 ...] [--output FILE[.gz]]
+           [--gzip] [--after STUDENT_ID | --resume]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import time
+from bson import ObjectId
+from app import EXPORT_BATCH_SIZE, EXPORT_CHUNK_STUDENTS, attendance_counters, attendance_records, students
+from services.export import AttendanceExport, last_exported_row
+
+
+def report(export, final=False):
+    label = 'Exported' if final else 'Exporting'
+    print(
+        f"{label}: {export.rows_written:,} rows, {export.rows_per_second:,.0f} rows/s, "
+        f"last student_id {export.last_student_id}",
+        file=sys.stderr
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export attendance as CSV')
+    parser.add_argument('--start-date', required=True, help='first date (inclusive)')
+    parser.add_argument('--end-date', required=True, help='last date (inclusive)')
+    parser.add_argument('--department', help='only students of this department')
+    parser.add_argument('--year', type=int, help='only students of this year')
+    parser.add_argument('--subject', action='append', help='only this subject (repeatable)')
+    parser.add_argument('--output', default='-', help='file to write, - for stdout (default)')
+    parser.add_argument('--gzip', action='store_true', help='compress the output (implied by a .gz file name)')
+    parser.add_argument('--after', help='start after this student_id')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted plain CSV file')
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE, help='records cursor batch size')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_STUDENTS, help='students per records query')
+    parser.add_argument('--progress-seconds', type=float, default=5, help='how often to report progress')
+    args = parser.parse_args()
+
+    compress = args.gzip or args.output.endswith('.gz')
+    after = ObjectId(args.after) if args.after else None
+    header = after is None
+    mode = 'wb'
+    if args.resume:
+        if compress or args.output == '-':
+            parser.error('--resume needs a plain CSV output file; use --after with a new file instead')
+        if os.path.exists(args.output):
+            last_id, offset = last_exported_row(args.output)
+            with open(args.output, 'r+b') as f:
+                # Drop a row cut off mid-write
+                f.truncate(offset)
+            after = ObjectId(last_id) if last_id else None
+            header = offset == 0
+            mode = 'ab'
+            print(f"Resuming after student_id {last_id}", file=sys.stderr)
+
+    student_query = {}
+    if args.department:
+        student_query['department'] = args.department
+    if args.year is not None:
+        student_query['year'] = args.year
+
+    export = AttendanceExport(
+        students, attendance_records, attendance_counters, student_query, args.start_date, args.end_date,
+        subject_codes=args.subject, after=after, batch_size=args.batch_size, chunk_size=args.chunk_size
+    )
+
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, mode)
+    next_report = time.perf_counter() + args.progress_seconds
+    try:
+        for data in export.iter_csv(compress=compress, header=header):
+            output.write(data)
+            if time.perf_counter() >= next_report:
+                report(export)
+                next_report = time.perf_counter() + args.progress_seconds
+    except KeyboardInterrupt:
+        report(export)
+        print(f"Interrupted; continue with --after {export.resume_after}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        output.flush()
+        if output is not sys.stdout.buffer:
+            output.close()
+    print(f"{len(export.columns):,} class days", file=sys.stderr)
+    report(export, final=True)
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+"""
+Deterministic synthetic dataset generator for load and capacity testing
+
+Builds a realistic campus: departments, per-year subjects, teachers, students and a
+full academic year of class sessions with attendance. The same arguments always
+produce the same content (names, enrollments, who attended which session), whatever
+the number of workers, because every department draws from its own seeded RNG.
+
+Documents are streamed to MongoDB with batched insert_many calls, departments can be
+generated in parallel worker processes, and progress is reported as it goes.
+
+All synthetic accounts use the @synthetic.attendmax email domain and department
+codes starting with SYN, so --reset can remove a previous run without touching
+anything else.
+
+Usage: python scripts/generate_dataset.py --departments 10 --students-per-year 400 --workers 4
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import datetime
+import random
+import time
+from multiprocessing import Pool
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from werkzeug.security import generate_password_hash
+from services.passwords import PASSWORD_HASH_METHOD
+from services.catalog import bump_catalog_version
+
+# Load environment variables
+load_dotenv()
+
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/attendmax')
+# Replace /attendmax with /Attendmax to match existing case
+if '/attendmax' in MONGO_URI:
+    MONGO_URI = MONGO_URI.replace('/attendmax', '/Attendmax')
+
+EMAIL_DOMAIN = 'synthetic.attendmax'
+DEPARTMENT_PREFIX = 'SYN'
+SLOT_TIMES = ['09:00:00', '10:00:00', '11:15:00', '12:15:00', '14:00:00', '15:00:00', '16:00:00']
+FIRST_NAMES = [
+    'Aarav', 'Aditi', 'Ananya', 'Arjun', 'Diya', 'Ishaan', 'Kavya', 'Meera', 'Neha', 'Nikhil',
+    'Priya', 'Rahul', 'Riya', 'Rohan', 'Sanya', 'Siddharth', 'Sneha', 'Tanvi', 'Varun', 'Zara',
+    'Alex', 'Emily', 'James', 'Maria', 'Noah', 'Olivia', 'Samuel', 'Sofia', 'Liam', 'Chloe'
+]
+LAST_NAMES = [
+    'Sharma', 'Patel', 'Iyer', 'Kulkarni', 'Deshmukh', 'Reddy', 'Nair', 'Joshi', 'Mehta', 'Gupta',
+    'Smith', 'Johnson', 'Lee', 'Chen', 'Garcia', 'Martinez', 'Brown', 'Wilson', 'Khan', 'Singh'
+]
+SUBJECT_TOPICS = [
+    'Mathematics', 'Physics', 'Programming', 'Data Structures', 'Algorithms', 'Databases',
+    'Networks', 'Operating Systems', 'Signals', 'Thermodynamics', 'Mechanics', 'Electronics',
+    'Statistics', 'Machine Learning', 'Security', 'Compilers', 'Graphics', 'Economics'
+]
+
+
+def get_db():
+    return MongoClient(MONGO_URI).Attendmax
+
+
+def department_code(index):
+    return f"{DEPARTMENT_PREFIX}{index:02d}"
+
+
+def batched(iterable, size):
+    """Yield lists of up to size items from any iterable without materializing it"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def class_dates(start_date, weeks, weekday):
+    """Every date in the term falling on weekday (0 = Monday)"""
+    first = start_date + datetime.timedelta(days=(weekday - start_date.weekday()) % 7)
+    for week in range(weeks):
+        yield first + datetime.timedelta(weeks=week)
+
+
+def build_department(args, index):
+    """Plan one department's subjects, teachers and students from its own seeded RNG"""
+    rng = random.Random(f"{args.seed}:{index}")
+    code = department_code(index)
+    created_at = datetime.datetime.fromisoformat(args.start_date)
+
+    subjects = []
+    for year in range(1, args.years + 1):
+        for number in range(1, args.subjects_per_year + 1):
+            subjects.append({
+                'name': f"{rng.choice(SUBJECT_TOPICS)} {year}{number:02d}",
+                'code': f"{code}{year}{number:02d}",
+                'department': code,
+                'year': year,
+                'credits': rng.choice([2, 3, 4]),
+                # Each subject meets at fixed slots on distinct weekdays (one record per student and day)
+                'slots': sorted(
+                    (weekday, rng.choice(SLOT_TIMES))
+                    for weekday in rng.sample(range(5), min(args.sessions_per_week, 5))
+                )
+            })
+
+    teacher_count = max(1, len(subjects) // 3)
+    teachers = []
+    for number in range(teacher_count):
+        name = f"Professor {rng.choice(LAST_NAMES)} {code}-{number:03d}"
+        teachers.append({
+            'name': name,
+            'email': f"teacher.{code.lower()}.{number:03d}@{EMAIL_DOMAIN}",
+            'department': code,
+            'subjects': [subject['code'] for subject in subjects[number::teacher_count]],
+            'created_at': created_at
+        })
+    teacher_for_subject = {
+        subject_code: teacher for teacher in teachers for subject_code in teacher['subjects']
+    }
+
+    students = []
+    for year in range(1, args.years + 1):
+        year_subjects = [subject['code'] for subject in subjects if subject['year'] == year]
+        for number in range(args.students_per_year):
+            prn = f"{code}{year}{number:05d}"
+            students.append({
+                'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                'prn': prn,
+                'email': f"{prn.lower()}@{EMAIL_DOMAIN}",
+                'department': code,
+                'year': year,
+                'subjects': year_subjects,
+                'created_at': created_at,
+                # Per-student attendance propensity; a skewed distribution yields some defaulters
+                '_attendance_rate': min(0.99, rng.betavariate(8, 2))
+            })
+
+    return {
+        'code': code,
+        'subjects': subjects,
+        'teachers': teachers,
+        'teacher_for_subject': teacher_for_subject,
+        'students': students,
+        'seed': f"{args.seed}:{index}:attendance"
+    }
+
+
+def insert_accounts(db, documents, role, password_hash):
+    """Create user accounts for teacher or student documents and link them"""
+    users = [
+        {
+            'username': document['email'].split('@')[0],
+            'email': document['email'],
+            'password': password_hash,
+            'role': role,
+            'first_login': True,
+            'created_at': document['created_at']
+        }
+        for document in documents
+    ]
+    for document, user_id in zip(documents, db.users.insert_many(users, ordered=False).inserted_ids):
+        document['user_id'] = user_id
+
+
+def generate_attendance(plan, start_date, weeks):
+    """Yield attendance records for every session of every subject in the department"""
+    rng = random.Random(plan['seed'])
+    students_by_year = {}
+    for student in plan['students']:
+        students_by_year.setdefault(student['year'], []).append(student)
+
+    for subject in plan['subjects']:
+        teacher = plan['teacher_for_subject'][subject['code']]
+        for weekday, time_str in subject['slots']:
+            for date in class_dates(start_date, weeks, weekday):
+                date_str = date.strftime('%Y-%m-%d')
+                timestamp = datetime.datetime.fromisoformat(f"{date_str}T{time_str}")
+                for student in students_by_year[subject['year']]:
+                    if rng.random() >= student['_attendance_rate']:
+                        continue
+                    yield {
+                        'student_id': student['_id'],
+                        'student_name': student['name'],
+                        'student_prn': student['prn'],
+                        'department': student['department'],
+                        'year': student['year'],
+                        'subject_code': subject['code'],
+                        'subject_name': subject['name'],
+                        'status': 'present',
+                        'date': date_str,
+                        'time': time_str,
+                        'timestamp': timestamp,
+                        'teacher_id': str(teacher['_id']),
+                        'teacher_name': teacher['name']
+                    }
+
+
+def generate_department(job):
+    """Generate and insert one department; runs in a worker process when --workers > 1"""
+    args, index, password_hashes = job
+    started = time.perf_counter()
+    db = get_db()
+    plan = build_department(args, index)
+    code = plan['code']
+
+    db.departments.insert_one({'name': f"Synthetic Department {index:02d}", 'code': code})
+    db.subjects.insert_many([
+        {key: value for key, value in subject.items() if key != 'slots'} for subject in plan['subjects']
+    ])
+
+    insert_accounts(db, plan['teachers'], 'teacher', password_hashes['teacher'])
+    db.teachers.insert_many(plan['teachers'])
+
+    insert_accounts(db, plan['students'], 'student', password_hashes['student'])
+    for batch in batched(plan['students'], args.batch_size):
+        result = db.students.insert_many(
+            [{key: value for key, value in student.items() if key != '_attendance_rate'} for student in batch],
+            ordered=False
+        )
+        # Keep the ids on the plan for the attendance records
+        for student, student_id in zip(batch, result.inserted_ids):
+            student['_id'] = student_id
+
+    start_date = datetime.date.fromisoformat(args.start_date)
+
+    # Every generated class was held and closed, so each enrolled student owes it a class day
+    class_days = {}
+    counters = {}
+    for subject in plan['subjects']:
+        for weekday, _ in subject['slots']:
+            for date in class_dates(start_date, args.weeks, weekday):
+                key = (subject['code'], date.strftime('%Y-%m'))
+                class_days[key] = class_days.get(key, 0) + 1
+                counters[(subject['code'], date.strftime('%Y-%m-%d'))] = 0
+    rollups = {}
+    for student in plan['students']:
+        for (subject_code, month), days in class_days.items():
+            if subject_code in student['subjects']:
+                rollups[(student['_id'], subject_code, month)] = {'present': 0, 'total': days}
+
+    inserted = 0
+    for batch in batched(generate_attendance(plan, start_date, args.weeks), args.batch_size):
+        db.attendance_records.insert_many(batch, ordered=False)
+        inserted += len(batch)
+        for record in batch:
+            key = (record['subject_code'], record['date'])
+            counters[key] = counters.get(key, 0) + 1
+            rollups[(record['student_id'], record['subject_code'], record['date'][:7])]['present'] += 1
+        if args.progress and inserted % (args.batch_size * args.progress) < args.batch_size:
+            rate = inserted / (time.perf_counter() - started)
+            print(f"  [{code}] {inserted} attendance records ({rate:,.0f}/s)", flush=True)
+
+    # Live counters and monthly rollups, as marking and closing the classes would have maintained them
+    for batch in batched(
+        (
+            {'subject_code': subject_code, 'date': date, 'marked': marked, 'absences_counted': True}
+            for (subject_code, date), marked in counters.items()
+        ),
+        args.batch_size
+    ):
+        db.attendance_counters.insert_many(batch, ordered=False)
+    for batch in batched(
+        (
+            {'student_id': student_id, 'subject_code': subject_code, 'month': month, **totals}
+            for (student_id, subject_code, month), totals in rollups.items()
+        ),
+        args.batch_size
+    ):
+        db.attendance_rollups.insert_many(batch, ordered=False)
+
+    return {
+        'department': code,
+        'subjects': len(plan['subjects']),
+        'teachers': len(plan['teachers']),
+        'students': len(plan['students']),
+        'records': inserted,
+        'seconds': time.perf_counter() - started
+    }
+
+
+def reset(db):
+    """Remove everything a previous run generated"""
+    department_filter = {'department': {'$regex': f"^{DEPARTMENT_PREFIX}"}}
+    db.attendance_records.delete_many(department_filter)
+    db.attendance_counters.delete_many({'subject_code': {'$regex': f"^{DEPARTMENT_PREFIX}"}})
+    db.attendance_rollups.delete_many({'subject_code': {'$regex': f"^{DEPARTMENT_PREFIX}"}})
+    db.students.delete_many(department_filter)
+    db.teachers.delete_many(department_filter)
+    db.subjects.delete_many(department_filter)
+    db.departments.delete_many({'code': {'$regex': f"^{DEPARTMENT_PREFIX}"}})
+    db.users.delete_many({'email': {'$regex': f"@{EMAIL_DOMAIN.replace('.', '[.]')}$"}})
+    print("Removed previously generated synthetic data")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a deterministic synthetic campus')
+    parser.add_argument('--departments', type=int, default=4)
+    parser.add_argument('--years', type=int, default=4, help='study years per department')
+    parser.add_argument('--students-per-year', type=int, default=60)
+    parser.add_argument('--subjects-per-year', type=int, default=5)
+    parser.add_argument('--sessions-per-week', type=int, default=2, help='class meetings per subject per week')
+    parser.add_argument('--weeks', type=int, default=36, help='length of the academic year in weeks')
+    parser.add_argument('--start-date', default='2025-08-04', help='first day of the academic year')
+    parser.add_argument('--seed', default='attendmax')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=1, help='parallel worker processes (one department each)')
+    parser.add_argument('--progress', type=int, default=20, help='report every N batches per department (0 = off)')
+    parser.add_argument('--reset', action='store_true', help='remove previously generated data first')
+    args = parser.parse_args()
+
+    db = get_db()
+    db.client.server_info()
+    if args.reset:
+        reset(db)
+    elif db.departments.find_one({'code': {'$regex': f"^{DEPARTMENT_PREFIX}"}}):
+        print("Synthetic data already exists; rerun with --reset to replace it")
+        return
+
+    # Every synthetic account shares one hash per role, so generation never waits on PBKDF2
+    password_hashes = {
+        'student': generate_password_hash('student123', PASSWORD_HASH_METHOD),
+        'teacher': generate_password_hash('teacher123', PASSWORD_HASH_METHOD)
+    }
+
+    started = time.perf_counter()
+    jobs = [(args, index, password_hashes) for index in range(1, args.departments + 1)]
+    if args.workers > 1:
+        with Pool(args.workers) as pool:
+            results = list(pool.imap_unordered(generate_department, jobs))
+    else:
+        results = [generate_department(job) for job in jobs]
+
+    elapsed = time.perf_counter() - started
+    for result in sorted(results, key=lambda result: result['department']):
+        print(f"{result['department']}: {result['students']} students, {result['teachers']} teachers, "
+              f"{result['subjects']} subjects, {result['records']} records in {result['seconds']:.1f}s")
+    total_records = sum(result['records'] for result in results)
+    print(f"Generated {sum(result['students'] for result in results)} students and {total_records} "
+          f"attendance records in {elapsed:.1f}s ({total_records / elapsed:,.0f} records/s)")
+
+    # Tell running servers to reload their subject catalog
+    bump_catalog_version(db.catalog_meta)
+
+
+if __name__ == '__main__':
+    main()
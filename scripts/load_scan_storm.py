@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""
+Load test for a QR scan storm
+
+Reproduces the real peak: a whole class scanning one teacher's QR code inside a
+single validity window while the teacher keeps the code fresh and polls the
+attendance status. A synthetic cohort is created and logged in up front, then
+every student scans from a thread pool at a random moment in the window.
+
+Reports throughput, p50/p95/p99 latency, error classes (expired, duplicate, ...)
+and MongoDB commands per scan. Runs in-process through the Flask test client by
+default, or against a running server with --url (setup and cleanup still talk to
+MONGO_URI directly; DB ops are only counted in-process). Exits non-zero when
+--max-p95-ms or --max-ops-per-scan is exceeded so it can gate a deployment.
+
+Usage: python scripts/load_scan_storm.py [--students N] [--concurrency N] [--url URL]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import collections
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from bench_common import SyntheticClass, attendmax, counter, percentile
+from services.passwords import PASSWORD_HASH_METHOD
+from werkzeug.security import generate_password_hash
+
+STORM_PASSWORD = 'storm-pass'
+
+storm_class = SyntheticClass('storm')
+
+
+class InProcessTransport:
+    """Send requests through one Flask test client per thread"""
+
+    counts_db_ops = True
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, token=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = attendmax.app.test_client()
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True) or {}
+
+
+class HTTPTransport:
+    """Send requests to a running server"""
+
+    counts_db_ops = False
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                return response.status, json.loads(response.read() or b'{}')
+        except urllib.error.HTTPError as e:
+            try:
+                return e.code, json.loads(e.read() or b'{}')
+            except ValueError:
+                return e.code, {}
+
+
+def classify(status, body):
+    """Map a scan response to an error class, or 'ok'"""
+    if status == 200:
+        return 'ok'
+    error = str(body.get('error', '')).lower()
+    if 'already marked' in error:
+        return 'duplicate'
+    if 'expired' in error:
+        return 'expired'
+    if status == 503:
+        return 'busy'
+    if 'invalid' in error or 'inactive' in error:
+        return 'invalid'
+    return f'http_{status}'
+
+
+def setup(student_count):
+    # Every synthetic account shares one hash so setup does not dominate the run
+    storm_class.setup(student_count, generate_password_hash(STORM_PASSWORD, PASSWORD_HASH_METHOD))
+
+
+def login_cohort(transport, student_count, concurrency):
+    """Log in the teacher and every student, returning their tokens"""
+    def login(email, role):
+        status, body = transport.request(
+            'POST', '/api/auth/login', {'email': email, 'password': STORM_PASSWORD, 'role': role}
+        )
+        if status != 200:
+            raise RuntimeError(f"Login failed for {email}: {status} {body}")
+        return body['token']
+
+    started = time.perf_counter()
+    teacher_token = login(storm_class.teacher_email(), 'teacher')
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        student_tokens = list(pool.map(
+            lambda i: login(storm_class.student_email(i), 'student'), range(student_count)
+        ))
+    elapsed = time.perf_counter() - started
+    print(f"Logged in {student_count + 1} accounts in {elapsed:.2f} s "
+          f"({(student_count + 1) / elapsed:.1f} logins/s)")
+    return teacher_token, student_tokens
+
+
+class Teacher(threading.Thread):
+    """Keep a fresh QR code on screen and poll the attendance status"""
+
+    def __init__(self, transport, token, refresh_seconds, poll_seconds):
+        super().__init__(daemon=True)
+        self.transport = transport
+        self.token = token
+        self.refresh_seconds = refresh_seconds
+        self.poll_seconds = poll_seconds
+        self.stop_event = threading.Event()
+        self.qr_code = None
+        self.codes_generated = 0
+        self.poll_latencies = []
+        self.poll_errors = 0
+
+    def generate(self):
+        status, body = self.transport.request(
+            'POST', '/api/teacher/generate_qr', {'subject_code': storm_class.subject}, self.token
+        )
+        if status != 200:
+            raise RuntimeError(f"QR generation failed: {status} {body}")
+        self.qr_code = body['qr_code']
+        self.codes_generated += 1
+
+    def run(self):
+        next_refresh = time.monotonic() + self.refresh_seconds
+        while not self.stop_event.wait(self.poll_seconds):
+            if time.monotonic() >= next_refresh:
+                self.generate()
+                next_refresh = time.monotonic() + self.refresh_seconds
+            started = time.perf_counter()
+            status, _ = self.transport.request(
+                'GET', f'/api/teacher/attendance/status?subject_code={storm_class.subject}', token=self.token
+            )
+            self.poll_latencies.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                self.poll_errors += 1
+
+
+def storm(transport, teacher, student_tokens, window, concurrency, duplicate_rate, rng):
+    """Fire every student's scan at a random moment in the window"""
+    # Some students tap twice; their second scan should come back as a duplicate
+    scans = [(rng.uniform(0, window), token) for token in student_tokens]
+    scans += [(rng.uniform(offset, window), token) for offset, token in scans if rng.random() < duplicate_rate]
+    scans.sort(key=lambda scan: scan[0])
+
+    results = []
+    results_lock = threading.Lock()
+    start = time.monotonic()
+
+    def scan(offset, token):
+        delay = start + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        before = counter.count()
+        started = time.perf_counter()
+        try:
+            status, body = transport.request('POST', '/api/attendance/mark', {'qr_data': teacher.qr_code}, token)
+            outcome = classify(status, body)
+        except Exception as e:
+            outcome = f'exception_{type(e).__name__}'
+        latency = (time.perf_counter() - started) * 1000
+        with results_lock:
+            results.append((outcome, latency, counter.count() - before))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, token in scans:
+            pool.submit(scan, offset, token)
+    return results, time.monotonic() - start
+
+
+def report(results, elapsed, teacher, transport, background_ops):
+    outcomes = collections.Counter(outcome for outcome, _, _ in results)
+    latencies = [latency for _, latency, _ in results]
+    ok_ops = [ops for outcome, _, ops in results if outcome == 'ok']
+    duplicate_ops = [ops for outcome, _, ops in results if outcome == 'duplicate']
+
+    print(f"Scans: {len(results)} in {elapsed:.2f} s ({len(results) / elapsed:.1f} req/s, "
+          f"{outcomes['ok'] / elapsed:.1f} marked/s)")
+    print(f"Latency ms: p50={percentile(latencies, 50):.2f} p95={percentile(latencies, 95):.2f} "
+          f"p99={percentile(latencies, 99):.2f} max={max(latencies):.2f}")
+    print("Outcomes: " + ', '.join(f"{outcome}={count}" for outcome, count in sorted(outcomes.items())))
+    if transport.counts_db_ops:
+        if ok_ops:
+            print(f"DB ops per scan: avg={statistics.mean(ok_ops):.2f} max={max(ok_ops)}")
+        if duplicate_ops:
+            print(f"DB ops per duplicate scan: avg={statistics.mean(duplicate_ops):.2f}")
+        print(f"Background DB ops (write buffers, teacher): {background_ops}")
+    if teacher.poll_latencies:
+        print(f"Teacher: {teacher.codes_generated} codes, {len(teacher.poll_latencies)} status polls, "
+              f"p95={percentile(teacher.poll_latencies, 95):.2f} ms, errors={teacher.poll_errors}")
+    return latencies, ok_ops
+
+
+def run(args):
+    transport = HTTPTransport(args.url) if args.url else InProcessTransport()
+    rng = random.Random(args.seed)
+
+    # The duplicate path depends on the unique attendance index
+    attendmax.create_indexes()
+    storm_class.cleanup()
+    setup(args.students)
+    try:
+        teacher_token, student_tokens = login_cohort(transport, args.students, args.concurrency)
+        teacher = Teacher(transport, teacher_token, args.qr_refresh, args.poll_interval)
+        teacher.generate()
+        teacher.start()
+
+        total_before = counter.total
+        results, elapsed = storm(
+            transport, teacher, student_tokens, args.window, args.concurrency, args.duplicate_rate, rng
+        )
+        teacher.stop_event.set()
+        teacher.join()
+        background_ops = counter.total - total_before - sum(ops for _, _, ops in results)
+
+        latencies, ok_ops = report(results, elapsed, teacher, transport, background_ops)
+    finally:
+        storm_class.cleanup()
+
+    # Regression gates
+    failed = False
+    if args.max_p95_ms is not None and percentile(latencies, 95) > args.max_p95_ms:
+        print(f"FAIL: p95 latency above {args.max_p95_ms} ms")
+        failed = True
+    if args.max_ops_per_scan is not None and ok_ops and max(ok_ops) > args.max_ops_per_scan:
+        print(f"FAIL: a scan issued more than {args.max_ops_per_scan} DB commands")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate a class scanning one QR code at once')
+    parser.add_argument('--students', type=int, default=300, help='students in the class')
+    parser.add_argument('--concurrency', type=int, default=64, help='scans in flight at once')
+    parser.add_argument('--window', type=float, default=attendmax.QR_VALID_SECONDS,
+                        help='seconds over which scans arrive')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help='fraction of students who scan twice')
+    parser.add_argument('--qr-refresh', type=float, default=attendmax.QR_VALID_SECONDS / 2,
+                        help='seconds between teacher QR refreshes')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='seconds between teacher status polls')
+    parser.add_argument('--url', help='base URL of a running server instead of the in-process app')
+    parser.add_argument('--seed', type=int, default=1, help='seed for scan arrival times')
+    parser.add_argument('--max-p95-ms', type=float, help='fail when p95 scan latency exceeds this')
+    parser.add_argument('--max-ops-per-scan', type=int, help='fail when a scan issues more DB commands')
+    args = parser.parse_args()
+    sys.exit(run(args))
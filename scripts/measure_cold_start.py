@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Measure how long a worker or CLI tool takes to become ready
+
+Times importing the app (which must do no network I/O), the first request that
+touches MongoDB, and optionally the one-shot bootstrap.
+
+Usage: python scripts/measure_cold_start.py [--bootstrap]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+
+started = time.perf_counter()
+import app as attendmax
+import_ms = (time.perf_counter() - started) * 1000
+
+
+if __name__ == '__main__':
+    print(f"Import and create_app: {import_ms:.1f} ms")
+
+    client = attendmax.app.test_client()
+    started = time.perf_counter()
+    client.get('/')
+    print(f"First request (no database): {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    started = time.perf_counter()
+    attendmax.subject_catalog.get('')
+    print(f"First database use (connect + catalog load): {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    if '--bootstrap' in sys.argv:
+        started = time.perf_counter()
+        attendmax.bootstrap()
+        print(f"Bootstrap: {(time.perf_counter() - started) * 1000:.1f} ms")
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""
+Recompute attendance_rollups from attendance_records
+
+Run after deployment to backfill rollups for existing records, after importing or
+editing records by hand, and periodically (e.g. nightly from cron) to repair drift.
+Stop servers from writing to the months being rebuilt, or rebuild past months only.
+
+Usage: python scripts/rebuild_rollups.py [--start-month YYYY-MM] [--end-month YYYY-MM]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import time
+from app import attendance_rollup_store, create_indexes
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild attendance rollups')
+    parser.add_argument('--start-month', help='first month to rebuild (inclusive)')
+    parser.add_argument('--end-month', help='last month to rebuild (inclusive)')
+    args = parser.parse_args()
+
+    create_indexes()
+    started = time.perf_counter()
+    written = attendance_rollup_store.rebuild(args.start_month, args.end_month)
+    print(f"Rebuilt attendance rollups: {written} documents in {time.perf_counter() - started:.1f}s")
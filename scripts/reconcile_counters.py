@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+"""
+Recompute attendance_counters from attendance_records
+
+Run after deployment to backfill counters for existing records, and periodically
+(e.g. nightly from cron) to repair any drift.
+
+Usage: python scripts/reconcile_counters.py [--start-date YYYY-MM-DD] [--end-date YYYY-MM-DD]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+from app import attendance_counter_store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reconcile attendance counters')
+    parser.add_argument('--start-date', help='first date to reconcile (inclusive)')
+    parser.add_argument('--end-date', help='last date to reconcile (inclusive)')
+    args = parser.parse_args()
+
+    fixed = attendance_counter_store.reconcile(args.start_date, args.end_date)
+    print(f"Reconciled attendance counters: {fixed} corrected")
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+Compare MongoDB indexes with the registry in services/indexes.py and fix them
+
+Builds missing indexes and updates TTLs in place; indexes the registry does not
+know about are reported, and dropped only with --drop-extra. With --check nothing
+is changed and the exit status is 1 when the database differs from the registry,
+so it can gate a deployment.
+
+Usage: python scripts/sync_indexes.py [--check | --drop-extra]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import time
+from app import get_db, index_registry
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sync MongoDB indexes with the registry')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--check', action='store_true', help='report differences without changing anything')
+    mode.add_argument('--drop-extra', action='store_true', help='also drop indexes missing from the registry')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.check:
+        report = index_registry.check(get_db())
+    else:
+        report = index_registry.sync(get_db(), drop_extra=args.drop_extra)
+    for line in report.lines():
+        print(line)
+    state = 'in sync' if report.in_sync else 'out of sync'
+    print(f"{len(index_registry.indexes)} indexes on {len(index_registry.collections())} collections "
+          f"{state} ({time.perf_counter() - started:.1f}s)")
+    sys.exit(0 if report.in_sync else 1)
@@ -0,0 +1,213 @@
+"""
+Department attendance analytics on an in-memory presence matrix
+"""
+import array
+import datetime
+import time
+from services.cache import SingleFlight, TTLCache
+from services.log import log_event
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+HEATMAP_GROUPS = ('weekday', 'date')
+
+
+class AnalyticsUnavailable(RuntimeError):
+    """NumPy is not installed"""
+
+
+class PresenceMatrix:
+    """Attendance of one department over a date range as students x class days arrays
+
+    ``present`` is True where a student was marked present; ``expected`` is True
+    where the student was enrolled in the class day's subject or has a record for
+    it. Class days are the (subject_code, date) pairs in attendance_counters.
+    """
+
+    def __init__(self, students, subjects, sessions, present, expected, stamp):
+        self.students = students
+        self.subjects = subjects
+        self.sessions = sessions
+        self.present = present
+        self.expected = expected
+        self.stamp = stamp
+        subject_index = {code: i for i, code in enumerate(subjects)}
+        self.session_subject = np.array([subject_index[code] for code, _ in sessions], dtype=np.int32)
+        self.session_weekday = np.array(
+            [datetime.date.fromisoformat(date).weekday() for _, date in sessions], dtype=np.int8
+        )
+        # sessions x subjects one-hot, so per-subject sums are one matrix product
+        self._by_subject = np.zeros((len(sessions), len(subjects)), dtype=np.int32)
+        self._by_subject[np.arange(len(sessions)), self.session_subject] = 1
+
+    @property
+    def nbytes(self):
+        return self.present.nbytes + self.expected.nbytes + self._by_subject.nbytes
+
+    def subject_counts(self):
+        """(present, expected) class days per student and subject, both students x subjects"""
+        present = self.present.astype(np.int32) @ self._by_subject
+        expected = self.expected.astype(np.int32) @ self._by_subject
+        return present, expected
+
+    def defaulters(self, threshold):
+        """Students below ``threshold`` percent in at least one subject, lowest first"""
+        present, expected = self.subject_counts()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percentages = np.where(expected > 0, present * 100.0 / expected, np.inf)
+        below = percentages < threshold
+        rows = np.flatnonzero(below.any(axis=1))
+        if rows.size:
+            rows = rows[np.argsort(percentages[rows].min(axis=1), kind='stable')]
+        result = []
+        for row in rows:
+            student = self.students[row]
+            result.append({
+                'student_id': str(student['_id']),
+                'prn': student.get('prn'),
+                'name': student.get('name'),
+                'year': student.get('year'),
+                'subjects': [
+                    {
+                        'subject_code': self.subjects[col],
+                        'present': int(present[row, col]),
+                        'total': int(expected[row, col]),
+                        'percentage': round(float(percentages[row, col]), 1)
+                    }
+                    for col in np.flatnonzero(below[row])
+                ]
+            })
+        return result
+
+    def heatmap(self, by='weekday'):
+        """Attendance rate per (weekday or date) x subject as {'rows', 'subjects', 'percentage', ...}"""
+        if by == 'weekday':
+            labels = list(WEEKDAYS)
+            row_of = self.session_weekday.astype(np.int32)
+        else:
+            dates = np.array([date for _, date in self.sessions])
+            labels, row_of = np.unique(dates, return_inverse=True)
+            labels = labels.tolist()
+        shape = (len(labels), len(self.subjects))
+        present = np.zeros(shape, dtype=np.int64)
+        expected = np.zeros(shape, dtype=np.int64)
+        np.add.at(present, (row_of, self.session_subject), self.present.sum(axis=0))
+        np.add.at(expected, (row_of, self.session_subject), self.expected.sum(axis=0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = np.where(expected > 0, np.round(present * 100.0 / expected, 1), np.nan)
+        return {
+            'rows': labels,
+            'subjects': self.subjects,
+            'present': present.tolist(),
+            'total': expected.tolist(),
+            # None where a subject has no class on that day
+            'percentage': [[None if np.isnan(value) else float(value) for value in row] for row in rates]
+        }
+
+
+class DepartmentAnalytics:
+    """Build PresenceMatrix objects and cache them per department and date range
+
+    A matrix is built from one projected cursor over the department's records.
+    Every mark, sync and bulk entry bumps the day's attendance_counters document,
+    so a cached matrix is reused only while a single aggregate over those counters
+    (count, total marked, latest update) returns the stamp it was built with.
+    """
+
+    def __init__(self, students, records, counters, ttl=600, maxsize=32, batch_size=5000):
+        self.students = students
+        self.records = records
+        self.counters = counters
+        self.batch_size = batch_size
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.flight = SingleFlight()
+
+    def _stamp(self, subjects, start_date, end_date):
+        stamp = list(self.counters.aggregate([
+            {'$match': {'subject_code': {'$in': subjects}, 'date': {'$gte': start_date, '$lte': end_date}}},
+            {'$group': {
+                '_id': None,
+                'days': {'$sum': 1},
+                'marked': {'$sum': '$marked'},
+                'updated_at': {'$max': '$updated_at'}
+            }}
+        ]))
+        if not stamp:
+            return (0, 0, None)
+        return (stamp[0]['days'], stamp[0]['marked'], stamp[0]['updated_at'])
+
+    def matrix(self, department, start_date, end_date):
+        """Cached PresenceMatrix for a department, rebuilt when its attendance changed"""
+        if np is None:
+            raise AnalyticsUnavailable('NumPy is required for attendance analytics')
+        key = (department, start_date, end_date)
+        cached = self.cache.get(key)
+        if cached is not None and cached.stamp == self._stamp(cached.subjects, start_date, end_date):
+            return cached
+
+        def build():
+            matrix = self.build(department, start_date, end_date)
+            self.cache.set(key, matrix)
+            return matrix
+
+        return self.flight.do(key, build)
+
+    def build(self, department, start_date, end_date):
+        """Load a department's attendance into a fresh PresenceMatrix"""
+        started = time.perf_counter()
+        roster = list(self.students.find(
+            {'department': department}, {'prn': 1, 'name': 1, 'year': 1, 'subjects': 1}
+        ).sort('_id', 1))
+        subjects = sorted({code for student in roster for code in student.get('subjects', [])})
+        # Read the stamp before the records so a concurrent write makes the next call rebuild
+        stamp = self._stamp(subjects, start_date, end_date)
+        sessions = [
+            (counter['subject_code'], counter['date'])
+            for counter in self.counters.find(
+                {'subject_code': {'$in': subjects}, 'date': {'$gte': start_date, '$lte': end_date}},
+                {'_id': 0, 'subject_code': 1, 'date': 1}
+            ).sort([('date', 1), ('subject_code', 1)])
+        ]
+        student_index = {student['_id']: i for i, student in enumerate(roster)}
+        session_index = {session: i for i, session in enumerate(sessions)}
+        subject_index = {code: i for i, code in enumerate(subjects)}
+
+        enrolled = np.zeros((len(roster), len(subjects)), dtype=bool)
+        for i, student in enumerate(roster):
+            enrolled[i, [subject_index[code] for code in student.get('subjects', [])]] = True
+        session_subject = np.array([subject_index[code] for code, _ in sessions], dtype=np.int32)
+        expected = enrolled[:, session_subject] if sessions else np.zeros((len(roster), 0), dtype=bool)
+        present = np.zeros((len(roster), len(sessions)), dtype=bool)
+
+        # Index triples are collected in compact arrays and applied in one scatter
+        rows, cols, marks = array.array('i'), array.array('i'), array.array('b')
+        cursor = self.records.find(
+            {'department': department, 'date': {'$gte': start_date, '$lte': end_date}},
+            {'_id': 0, 'student_id': 1, 'subject_code': 1, 'date': 1, 'status': 1}
+        ).batch_size(self.batch_size)
+        for record in cursor:
+            row = student_index.get(record['student_id'])
+            col = session_index.get((record['subject_code'], record['date']))
+            if row is None or col is None:
+                continue
+            rows.append(row)
+            cols.append(col)
+            marks.append(record['status'] == 'present')
+        if rows:
+            rows = np.frombuffer(rows, dtype=np.intc)
+            cols = np.frombuffer(cols, dtype=np.intc)
+            present[rows, cols] = np.frombuffer(marks, dtype=np.int8).astype(bool)
+            # A record counts even if the student has since dropped the subject
+            expected[rows, cols] = True
+
+        matrix = PresenceMatrix(roster, subjects, sessions, present, expected, stamp)
+        log_event(
+            'analytics_matrix_built', department=department, start_date=start_date, end_date=end_date,
+            students=len(roster), sessions=len(sessions), records=len(marks), bytes=matrix.nbytes,
+            seconds=round(time.perf_counter() - started, 3)
+        )
+        return matrix
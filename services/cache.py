@@ -0,0 +1,137 @@
+"""
+In-process caching helpers for AttendMax
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a fixed number of seconds"""
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                # Expired entries are dropped on read
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting the least recently used entry when full"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Remove a single entry from the cache"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return size and hit/miss counters for monitoring"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution
+
+    The first caller for a key runs the function; callers arriving while it is
+    still running wait for and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+            else:
+                self.shared += 1
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+
+class PeriodicRefresh:
+    """Call ``refresh`` at most once every ``interval`` seconds for an in-memory snapshot
+
+    The first call waits for the initial load. After that only one request thread
+    refreshes when the snapshot is due; the others keep using the current one
+    rather than queueing behind it.
+    """
+
+    def __init__(self, refresh, interval):
+        self.refresh = refresh
+        self.interval = interval
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def due(self):
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.interval
+
+    def maybe_run(self):
+        if not self.due() or not self.lock.acquire(blocking=self.refreshed_at is None):
+            return
+        try:
+            if self.due():
+                self._run()
+        finally:
+            self.lock.release()
+
+    def run(self, refresh=None):
+        """Refresh now, with ``refresh`` in place of the usual function if given"""
+        with self.lock:
+            self._run(refresh)
+
+    def _run(self, refresh=None):
+        (refresh or self.refresh)()
+        self.refreshed_at = time.monotonic()
@@ -0,0 +1,104 @@
+"""
+Process-wide subject catalog
+
+The subject list is tiny and nearly static, so every worker keeps the whole of it in
+memory, indexed by code and by (department, year). Writers bump a version counter in
+the catalog_meta collection; workers compare it every few seconds and reload when it
+changes, so edits made by any process or script propagate without a restart. The
+same counters tell workers to drop cached accounts after bulk account changes.
+"""
+from services.cache import PeriodicRefresh
+
+CATALOG_ID = 'subjects'
+ACCOUNTS_ID = 'accounts'
+
+
+def bump_catalog_version(meta_collection, catalog_id=CATALOG_ID):
+    """Signal every worker that the subjects collection (or ``catalog_id``) changed"""
+    meta_collection.update_one({'_id': catalog_id}, {'$inc': {'version': 1}}, upsert=True)
+
+
+class VersionWatch:
+    """Call ``on_change`` in this worker when a catalog_meta version moves
+
+    The first check only records the current version; later ones, at most every
+    ``check_seconds``, cost one find_one.
+    """
+
+    def __init__(self, meta_collection, catalog_id, on_change, check_seconds=10):
+        self.meta_collection = meta_collection
+        self.catalog_id = catalog_id
+        self.on_change = on_change
+        self.version = None
+        self._refresh = PeriodicRefresh(self._check, check_seconds)
+
+    def _check(self):
+        meta = self.meta_collection.find_one({'_id': self.catalog_id})
+        version = meta.get('version', 0) if meta else 0
+        if self.version is not None and version != self.version:
+            self.on_change()
+        self.version = version
+
+    def check(self):
+        self._refresh.maybe_run()
+
+
+class SubjectCatalog:
+    """In-memory copy of the subjects collection with versioned invalidation"""
+
+    def __init__(self, collection, meta_collection, check_seconds=10):
+        self.collection = collection
+        self.meta_collection = meta_collection
+        self.check_seconds = check_seconds
+        self.version = None
+        self.loads = 0
+        self._by_code = {}
+        self._by_group = {}
+        # Checking costs one find_one on catalog_meta; the subjects are only read when it changed
+        self._refresh = PeriodicRefresh(self._check, check_seconds)
+
+    def _read_version(self):
+        meta = self.meta_collection.find_one({'_id': CATALOG_ID})
+        return meta.get('version', 0) if meta else 0
+
+    def load(self):
+        """Load every subject from the database"""
+        version = self._read_version()
+        subjects = list(self.collection.find({}))
+        by_code = {}
+        # One list per filter find() accepts: (department, year), with None meaning any
+        by_group = {}
+        for subject in subjects:
+            # Codes are unique per department; the first match wins, as with find_one
+            by_code.setdefault(subject['code'], subject)
+            department, year = subject.get('department'), subject.get('year')
+            for key in {(department, year), (department, None), (None, year), (None, None)}:
+                by_group.setdefault(key, []).append(subject)
+        self._by_code = by_code
+        self._by_group = by_group
+        self.version = version
+        self.loads += 1
+
+    def _check(self):
+        if self.version is None or self._read_version() != self.version:
+            self.load()
+
+    def invalidate(self):
+        """Publish a change to the subjects collection and reload this worker's copy"""
+        bump_catalog_version(self.meta_collection)
+        self._refresh.run(self.load)
+
+    def get(self, code):
+        """Return the subject document for a code, or None; callers must not mutate it"""
+        self._refresh.maybe_run()
+        return self._by_code.get(code)
+
+    def name(self, code):
+        """Return a subject's display name, falling back to its code"""
+        subject = self.get(code)
+        return subject['name'] if subject else code
+
+    def find(self, department=None, year=None):
+        """Return subjects filtered by department and year, as /api/subjects does"""
+        self._refresh.maybe_run()
+        return self._by_group.get((department, year), [])
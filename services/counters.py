@@ -0,0 +1,89 @@
+"""
+Live per-subject, per-day attendance counters
+"""
+import datetime
+from pymongo import ReturnDocument, UpdateOne
+from services.cache import TTLCache
+
+
+class AttendanceCounters:
+    """Maintained scan counts for each (subject_code, date), fronted by a short-TTL cache
+
+    Counter documents live in the attendance_counters collection and are bumped with
+    ``$inc`` whenever a student is marked present (a scan, or a teacher's bulk
+    update), so reading the number of students marked for a class is a single
+    indexed lookup instead of a scan over attendance_records. ``reconcile``
+    recomputes counters from the raw records to repair any drift (failed
+    increments, manual edits, records inserted by scripts).
+    """
+
+    def __init__(self, collection, records, ttl=5):
+        self.collection = collection
+        self.records = records
+        self.cache = TTLCache(maxsize=5000, ttl=ttl)
+
+    def increment_state(self, subject_code, date, amount=1):
+        """Record new attendance and return the counter document (marked, absences_counted)"""
+        counter = self.collection.find_one_and_update(
+            {'subject_code': subject_code, 'date': date},
+            {'$inc': {'marked': amount}, '$set': {'updated_at': datetime.datetime.utcnow()}},
+            projection={'_id': 0, 'marked': 1, 'absences_counted': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.cache.set((subject_code, date), counter['marked'])
+        return counter
+
+    def get(self, subject_code, date):
+        """Return the number of students marked for a subject on a date"""
+        key = (subject_code, date)
+        marked = self.cache.get(key)
+        if marked is None:
+            counter = self.collection.find_one(
+                {'subject_code': subject_code, 'date': date},
+                {'_id': 0, 'marked': 1}
+            )
+            marked = counter['marked'] if counter else 0
+            self.cache.set(key, marked)
+        return marked
+
+    def reconcile(self, start_date=None, end_date=None):
+        """Recompute counters from attendance_records, returning the number corrected"""
+        match = {}
+        if start_date or end_date:
+            match['date'] = {}
+            if start_date:
+                match['date']['$gte'] = start_date
+            if end_date:
+                match['date']['$lte'] = end_date
+
+        actual = {
+            (group['_id']['subject_code'], group['_id']['date']): group['marked']
+            for group in self.records.aggregate([
+                {'$match': match},
+                {'$group': {
+                    '_id': {'subject_code': '$subject_code', 'date': '$date'},
+                    'marked': {'$sum': {'$cond': [{'$eq': ['$status', 'present']}, 1, 0]}}
+                }}
+            ])
+        }
+        stored = {
+            (counter['subject_code'], counter['date']): counter.get('marked', 0)
+            for counter in self.collection.find(match, {'_id': 0, 'subject_code': 1, 'date': 1, 'marked': 1})
+        }
+
+        now = datetime.datetime.utcnow()
+        fixes = []
+        for key in set(actual) | set(stored):
+            marked = actual.get(key, 0)
+            if stored.get(key) != marked:
+                subject_code, date = key
+                fixes.append(UpdateOne(
+                    {'subject_code': subject_code, 'date': date},
+                    {'$set': {'marked': marked, 'updated_at': now}},
+                    upsert=True
+                ))
+        if fixes:
+            self.collection.bulk_write(fixes, ordered=False)
+        self.cache.clear()
+        return len(fixes)
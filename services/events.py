@@ -0,0 +1,182 @@
+"""
+Live event fan-out for Server-Sent Events streams
+"""
+import collections
+import json
+import logging
+import queue
+import threading
+from services.cache import TTLCache
+from services.log import log_event
+
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class EventBroker:
+    """In-process publish/subscribe keyed by channel (one channel per class session)
+
+    Each subscriber gets its own bounded queue; a subscriber that falls behind loses
+    its oldest events rather than slowing down publishers.
+    """
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.published = 0
+        self.dropped = 0
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self._lock:
+            subscribers = self._channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._channels[channel]
+
+    def publish(self, channel, event):
+        """Deliver event to every current subscriber of channel"""
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        self.published += 1
+        return len(subscribers)
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(subscribers) for subscribers in self._channels.values())
+
+
+def format_sse(data, event=None, event_id=None):
+    """Encode one Server-Sent Events message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class ChangeStreamRelay:
+    """Publish changes from every worker by tailing a MongoDB change stream
+
+    Needed when the app runs as several processes, since a scan only reaches the
+    in-process broker of the worker that handled it. Requires a replica set.
+    ``target`` is the collection or database to watch with ``pipeline``;
+    ``to_events`` turns a change document into a list of ``(channel, event)``.
+    """
+
+    def __init__(self, target, pipeline, broker, to_events, full_document=None, full_document_before_change=None):
+        self.target = target
+        self.pipeline = pipeline
+        self.broker = broker
+        self.to_events = to_events
+        self.full_document = full_document
+        self.full_document_before_change = full_document_before_change
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start tailing the change stream once per process"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='attendance-change-stream', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        resume_token = None
+        while True:
+            try:
+                with self.target.watch(
+                    self.pipeline, full_document=self.full_document,
+                    full_document_before_change=self.full_document_before_change, resume_after=resume_token
+                ) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        for published in self.to_events(change):
+                            self.broker.publish(*published)
+            except Exception as e:
+                log_event('change_stream_interrupted', logging.WARNING, error=str(e))
+                threading.Event().wait(1)
+
+
+class ScanCountPairing:
+    """Pair attendance inserts with the counter changes that follow them
+
+    A scan inserts its record and only then increments the day's counter, so the
+    count read when the insert arrives can be one behind. Instead, records wait
+    here until the counter's own change event for their subject and day: a change
+    that raises the count by n releases the n oldest waiting records with
+    consecutive counts ending at the new value. The count before the change comes
+    from the change's pre-image (enable changeStreamPreAndPostImages on the counters
+    collection), else from the last change seen; with neither, every waiting record
+    is released with the new count.
+    """
+
+    def __init__(self, records_name, counters_name, to_event, max_days=5000, max_pending=1000):
+        self.records_name = records_name
+        self.counters_name = counters_name
+        self.to_event = to_event
+        self.max_pending = max_pending
+        self._pending = TTLCache(maxsize=max_days, ttl=86400)
+        self._counts = TTLCache(maxsize=max_days, ttl=86400)
+
+    def pipeline(self):
+        return [{'$match': {'$or': [
+            {'ns.coll': self.records_name, 'operationType': 'insert'},
+            {'ns.coll': self.counters_name, 'operationType': {'$in': ['insert', 'update']}}
+        ]}}]
+
+    def handle(self, change):
+        """Return the (channel, event) pairs a change releases"""
+        document = change.get('fullDocument')
+        if document is None:
+            return []
+        key = (document['subject_code'], document['date'])
+        if change['ns']['coll'] == self.records_name:
+            # Records marked without a class session (bulk entries) have no live feed
+            if 'session_id' in document:
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = collections.deque(maxlen=self.max_pending)
+                    self._pending.set(key, pending)
+                pending.append(document)
+            return []
+
+        # The value written by this update, not the looked-up document's current one
+        updated = change.get('updateDescription', {}).get('updatedFields', {})
+        marked = updated.get('marked', document.get('marked', 0))
+        before = change.get('fullDocumentBeforeChange')
+        if change['operationType'] == 'insert':
+            previous = 0
+        elif before is not None:
+            previous = before.get('marked', 0)
+        else:
+            previous = self._counts.get(key)
+        self._counts.set(key, marked)
+        pending = self._pending.get(key) or collections.deque()
+        if previous is None:
+            # Bulk entries and reconciles move the count by more than one, so do not guess
+            return [self.to_event(pending.popleft(), marked) for _ in range(len(pending))]
+        released = min(max(marked - previous, 0), len(pending))
+        first = marked - released + 1
+        return [self.to_event(pending.popleft(), first + i) for i in range(released)]
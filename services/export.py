@@ -0,0 +1,199 @@
+"""
+Streaming CSV exports of attendance, one row per student and one column per class day
+"""
+import csv
+import io
+import os
+import time
+import zlib
+
+# Cell values; a student enrolled in a subject with no record for a class day is absent
+STATUS_CODES = {'present': 'P', 'absent': 'A'}
+# Encoded CSV is handed to the client (or file) in chunks of about this size
+CHUNK_BYTES = 64 * 1024
+
+
+class AttendanceExport:
+    """Pivoted student x class-day attendance grid for a set of students and a date range
+
+    Columns are the class days (subject and date) in attendance_counters for the
+    subjects the selected students take. Rows follow student ``_id`` order: students
+    are read from one cursor ``chunk_size`` at a time and each chunk's records are
+    fetched with a single query on the (student_id, subject_code, date) index, so
+    memory holds one chunk however many students are exported. ``after`` resumes an
+    export after the student_id in the first column of the last row received.
+    """
+
+    def __init__(self, students, records, counters, student_query, start_date, end_date,
+                 subject_codes=None, after=None, batch_size=2000, chunk_size=500):
+        self.students = students
+        self.records = records
+        self.counters = counters
+        self.student_query = dict(student_query)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.subject_codes = subject_codes
+        self.after = after
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.columns = None
+        self.rows_written = 0
+        self.last_student_id = None
+        # Last student whose row is in the output handed out so far
+        self.resume_after = None
+        self.started = None
+
+    def load_columns(self):
+        """Class days in the range, ordered by date then subject"""
+        subjects = self.students.distinct('subjects', self.student_query)
+        if self.subject_codes:
+            subjects = [code for code in subjects if code in self.subject_codes]
+        self.columns = [
+            (counter['subject_code'], counter['date'])
+            for counter in self.counters.find(
+                {'subject_code': {'$in': subjects}, 'date': {'$gte': self.start_date, '$lte': self.end_date}},
+                {'_id': 0, 'subject_code': 1, 'date': 1}
+            ).sort([('date', 1), ('subject_code', 1)])
+        ]
+        return self.columns
+
+    def header(self):
+        return (
+            ['student_id', 'prn', 'name', 'department', 'year']
+            + [f'{date} {subject_code}' for subject_code, date in self.columns]
+            + ['present', 'total', 'percentage']
+        )
+
+    def _marks(self, chunk):
+        """{student_id: {(subject_code, date): status}} for one chunk of students"""
+        marks = {student['_id']: {} for student in chunk}
+        query = {
+            'student_id': {'$in': list(marks)},
+            'date': {'$gte': self.start_date, '$lte': self.end_date}
+        }
+        if self.subject_codes:
+            query['subject_code'] = {'$in': list(self.subject_codes)}
+        cursor = self.records.find(
+            query, {'_id': 0, 'student_id': 1, 'subject_code': 1, 'date': 1, 'status': 1}
+        ).batch_size(self.batch_size)
+        for record in cursor:
+            marks[record['student_id']][(record['subject_code'], record['date'])] = record['status']
+        return marks
+
+    def _row(self, student, marks):
+        enrolled = set(student.get('subjects', []))
+        cells = []
+        present = total = 0
+        for column in self.columns:
+            status = marks.get(column)
+            if status is None and column[0] not in enrolled:
+                cells.append('')
+                continue
+            code = STATUS_CODES.get(status or 'absent', str(status)[:1].upper())
+            cells.append(code)
+            total += 1
+            present += code == 'P'
+        return (
+            [str(student['_id']), student.get('prn', ''), student.get('name', ''),
+             student.get('department', ''), student.get('year', '')]
+            + cells
+            + [present, total, round(present / total * 100, 1) if total else '']
+        )
+
+    def rows(self):
+        """Yield one CSV row (a list) per student"""
+        if self.columns is None:
+            self.load_columns()
+        query = dict(self.student_query)
+        if self.after is not None:
+            query['_id'] = {'$gt': self.after}
+        cursor = self.students.find(
+            query, {'prn': 1, 'name': 1, 'department': 1, 'year': 1, 'subjects': 1}
+        ).sort('_id', 1).batch_size(self.chunk_size)
+        chunk = []
+        for student in cursor:
+            chunk.append(student)
+            if len(chunk) >= self.chunk_size:
+                yield from self._emit(chunk)
+                chunk = []
+        if chunk:
+            yield from self._emit(chunk)
+
+    def _emit(self, chunk):
+        marks = self._marks(chunk)
+        for student in chunk:
+            row = self._row(student, marks[student['_id']])
+            self.rows_written += 1
+            self.last_student_id = student['_id']
+            yield row
+
+    def iter_csv(self, compress=False, header=True):
+        """Yield the export as encoded CSV chunks, gzip-compressed on the fly if ``compress``
+
+        Compressed chunks end on a sync flush, so everything handed out can be
+        decompressed even if the export stops before the gzip trailer.
+        """
+        self.started = time.perf_counter()
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+
+        def drain():
+            data = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            self.resume_after = self.last_student_id
+            if compressor:
+                return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            return data
+
+        if self.columns is None:
+            self.load_columns()
+        if header:
+            writer.writerow(self.header())
+        for row in self.rows():
+            writer.writerow(row)
+            if buffer.tell() >= CHUNK_BYTES:
+                data = drain()
+                if data:
+                    yield data
+        data = drain()
+        if compressor:
+            data += compressor.flush()
+        if data:
+            yield data
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return self.rows_written / elapsed if elapsed else 0.0
+
+
+def last_exported_row(path, block_size=64 * 1024):
+    """Find where an interrupted plain CSV export stopped
+
+    Returns (student_id of the last complete row or None, byte offset just past it),
+    reading only the end of the file.
+    """
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        tail = b''
+        lines = [b'']
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+            lines = tail.split(b'\n')
+            # lines[-1] is an unfinished row, or b'' when the file ends with a newline
+            if len(lines) >= 3:
+                break
+    if len(lines) < 2:
+        return None, 0
+    complete_end = end - len(lines[-1])
+    if position == 0 and len(lines) == 2:
+        # Only the header row was written
+        return None, complete_end
+    row = next(csv.reader([lines[-2].decode('utf-8')]))
+    return row[0], complete_end
@@ -0,0 +1,164 @@
+"""
+Declarative MongoDB index registry
+"""
+from pymongo.errors import OperationFailure
+
+# Options that make two indexes on the same keys behave differently
+COMPARED_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression')
+
+
+class Index:
+    """One index on a collection: keys as for create_index plus its options
+
+    The name defaults to the one MongoDB generates (``subject_code_1_date_1``), so
+    indexes created before the registry existed are recognised.
+    """
+
+    def __init__(self, collection, keys, **options):
+        self.collection = collection
+        self.keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        self.name = options.pop('name', None) or '_'.join(f'{field}_{direction}' for field, direction in self.keys)
+        self.options = options
+
+    def differences(self, existing):
+        """Options or keys that differ from an index description from list_indexes"""
+        differences = []
+        keys = [(field, int(direction) if isinstance(direction, float) else direction)
+                for field, direction in existing['key'].items()]
+        if keys != self.keys:
+            differences.append('key')
+        for option in COMPARED_OPTIONS:
+            if existing.get(option) != self.options.get(option):
+                # unique/sparse may be reported as absent instead of False
+                if not (option in ('unique', 'sparse') and not existing.get(option) and not self.options.get(option)):
+                    differences.append(option)
+        return differences
+
+    def __repr__(self):
+        options = ''.join(f', {name}={value!r}' for name, value in self.options.items())
+        return f'{self.collection}.{self.name}{options}'
+
+
+class IndexReport:
+    """Result of comparing the registry with a database"""
+
+    def __init__(self):
+        self.missing = []
+        self.changed = []
+        self.extra = []
+        self.created = []
+        self.updated = []
+        self.dropped = []
+        self.failed = []
+
+    def outstanding(self):
+        """(missing, changed, extra) left after any fixes sync applied"""
+        failed = [index for index, _ in self.failed]
+        missing = [index for index in self.missing if index not in self.created and index not in failed]
+        changed = [(index, diff) for index, diff in self.changed if index not in self.updated]
+        extra = [item for item in self.extra if item not in self.dropped]
+        return missing, changed, extra
+
+    @property
+    def in_sync(self):
+        missing, changed, extra = self.outstanding()
+        return not (missing or changed or extra or self.failed)
+
+    def lines(self):
+        """Human-readable summary, one line per index"""
+        missing, changed, extra = self.outstanding()
+        lines = []
+        lines += [f'created  {index!r}' for index in self.created]
+        lines += [f'updated  {index!r}' for index in self.updated]
+        lines += [f'dropped  {collection}.{name}' for collection, name in self.dropped]
+        lines += [f'missing  {index!r}' for index in missing]
+        lines += [f'changed  {index!r} ({", ".join(diff)})' for index, diff in changed]
+        lines += [f'extra    {collection}.{name}' for collection, name in extra]
+        lines += [f'failed   {index!r}: {error}' for index, error in self.failed]
+        return lines
+
+
+class IndexRegistry:
+    """Every index the application relies on, checked and built in one place
+
+    ``check`` costs one listIndexes command per collection and changes nothing;
+    ``sync`` also builds missing indexes, updates TTLs in place with collMod and,
+    if asked, drops indexes the registry does not know about. An index whose keys
+    or other options changed is only reported: rebuilding it means dropping it
+    first, which is left to an operator.
+    """
+
+    def __init__(self, indexes):
+        self.indexes = list(indexes)
+
+    def collections(self):
+        return sorted({index.collection for index in self.indexes})
+
+    def check(self, db):
+        report = IndexReport()
+        for collection in self.collections():
+            existing = {info['name']: info for info in db[collection].list_indexes()}
+            wanted = [index for index in self.indexes if index.collection == collection]
+            for index in wanted:
+                info = existing.get(index.name)
+                if info is None:
+                    report.missing.append(index)
+                else:
+                    differences = index.differences(info)
+                    if differences:
+                        report.changed.append((index, differences))
+            known = {index.name for index in wanted} | {'_id_'}
+            report.extra += [(collection, name) for name in existing if name not in known]
+        return report
+
+    def sync(self, db, drop_extra=False):
+        report = self.check(db)
+        for index in report.missing:
+            try:
+                db[index.collection].create_index(index.keys, name=index.name, **index.options)
+                report.created.append(index)
+            except OperationFailure as e:
+                # e.g. existing duplicates block a unique index
+                report.failed.append((index, str(e)))
+        for index, differences in report.changed:
+            if differences == ['expireAfterSeconds'] and 'expireAfterSeconds' in index.options:
+                db.command('collMod', index.collection, index={
+                    'name': index.name, 'expireAfterSeconds': index.options['expireAfterSeconds']
+                })
+                report.updated.append(index)
+        if drop_extra:
+            for collection, name in report.extra:
+                db[collection].drop_index(name)
+                report.dropped.append((collection, name))
+        return report
+
+
+def application_indexes(retention_seconds=86400):
+    """The AttendMax index registry; ``retention_seconds`` is how long expired QR data is kept"""
+    return IndexRegistry([
+        Index('users', 'email', unique=True),
+        Index('users', 'username', unique=True),
+        Index('students', 'prn', unique=True),
+        Index('students', 'email', unique=True),
+        # Profile lookups after login, and roster queries (multikey)
+        Index('students', 'user_id'),
+        Index('students', 'subjects'),
+        Index('teachers', 'email', unique=True),
+        Index('teachers', 'user_id'),
+        Index('departments', 'code', unique=True),
+        Index('subjects', [('code', 1), ('department', 1)], unique=True),
+        Index('revoked_tokens', 'expires_at', expireAfterSeconds=0),
+        Index('revoked_tokens', 'jti', unique=True, sparse=True),
+        # One record per student, subject and day; mark_attendance relies on it to detect repeats
+        Index('attendance_records', [('student_id', 1), ('subject_code', 1), ('date', 1)], unique=True),
+        # A student's history by date, a class day's records, and department analytics
+        Index('attendance_records', [('student_id', 1), ('date', 1)]),
+        Index('attendance_records', [('subject_code', 1), ('date', 1)]),
+        Index('attendance_records', [('department', 1), ('date', 1)]),
+        Index('attendance_counters', [('subject_code', 1), ('date', 1)], unique=True),
+        Index('attendance_rollups', [('student_id', 1), ('subject_code', 1), ('month', 1)], unique=True),
+        Index('class_sessions', [('teacher_id', 1), ('subject_code', 1), ('expires_at', -1)]),
+        Index('class_sessions', 'expires_at', expireAfterSeconds=retention_seconds),
+        # Per-scan QR documents from before class sessions; expire them like sessions
+        Index('qr_codes', 'expires_at', expireAfterSeconds=retention_seconds),
+    ])
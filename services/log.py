@@ -0,0 +1,196 @@
+"""
+Structured JSON logging written off the request thread
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from flask import g, has_app_context, request
+
+logger = logging.getLogger('attendmax')
+
+# Longest X-Request-ID accepted from a client or proxy
+MAX_REQUEST_ID_LENGTH = 128
+
+
+def log_event(event, level=logging.INFO, exc_info=False, **fields):
+    """Log a named event with structured fields, e.g. log_event('login_failed', email=...)"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={'event': event, 'fields': fields})
+
+
+def parse_event_rates(value, cast=float):
+    """Parse 'event=rate,event=rate' into a dict"""
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            event, rate = item.split('=', 1)
+            rates[event.strip()] = cast(rate)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, event, request id and the event's fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname.lower(),
+            'event': getattr(record, 'event', None) or record.name,
+            'pid': record.process
+        }
+        if not hasattr(record, 'event'):
+            entry['message'] = record.getMessage()
+        for attr in ('request_id', 'sample_rate', 'suppressed'):
+            value = getattr(record, attr, None)
+            if value is not None:
+                entry[attr] = value
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request's ID while still on the request thread"""
+
+    def filter(self, record):
+        if has_app_context():
+            record.request_id = g.get('request_id')
+        return True
+
+
+class EventSampler(logging.Filter):
+    """Drop a share of noisy events and cap others per second
+
+    ``sample_rates`` maps event names to the fraction kept; warnings and errors are
+    never sampled. ``rate_limits`` maps event names to the most records per second
+    per process; the next record let through carries a ``suppressed`` count.
+    """
+
+    def __init__(self, sample_rates=None, rate_limits=None):
+        super().__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limits = dict(rate_limits or {})
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event is None:
+            return True
+        rate = self.sample_rates.get(event)
+        if rate is not None and record.levelno < logging.WARNING:
+            if self._random.random() >= rate:
+                return False
+            record.sample_rate = rate
+        limit = self.rate_limits.get(event)
+        if limit is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(event)
+            if window is None or now - window[0] >= 1:
+                if window and window[2]:
+                    record.suppressed = window[2]
+                window = self._windows[event] = [now, 0, 0]
+            if window[1] >= limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """Queue records for a writer thread so request threads never block on stdout
+
+    Each worker process starts its own writer on first use. When the queue is
+    full, records are dropped and counted rather than stalling the request.
+    """
+
+    def __init__(self, target, queue_size):
+        super().__init__(queue.Queue(queue_size))
+        self.target = target
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(self.queue_size)
+                self._listener = logging.handlers.QueueListener(self.queue, self.target)
+                self._listener.start()
+                self._pid = os.getpid()
+                atexit.register(self.stop)
+
+    def prepare(self, record):
+        # Only the exception text must be rendered here; JSON encoding happens on the writer thread
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Flush queued records; called at exit"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+def configure_logging(level='INFO', sample_rates=None, rate_limits=None, queue_size=10000, stream=None):
+    """Send the attendmax logger through the background JSON handler"""
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(JsonFormatter())
+    handler = BackgroundQueueHandler(target, queue_size)
+    handler.addFilter(EventSampler(sample_rates, rate_limits))
+    handler.addFilter(RequestIdFilter())
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+        if isinstance(old, BackgroundQueueHandler):
+            old.stop()
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    return handler
+
+
+def init_request_ids(app):
+    """Give each request an ID, reusing a proxy's X-Request-ID, and echo it back"""
+    @app.before_request
+    def assign_request_id():
+        request_id = request.headers.get('X-Request-ID', '')
+        if not request_id or len(request_id) > MAX_REQUEST_ID_LENGTH:
+            request_id = uuid.uuid4().hex
+        g.request_id = request_id
+
+    @app.after_request
+    def echo_request_id(response):
+        if g.get('request_id'):
+            response.headers['X-Request-ID'] = g.request_id
+        return response
@@ -0,0 +1,304 @@
+"""
+Prometheus text-format metrics, aggregated across worker processes
+"""
+import atexit
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from flask import g, request
+from pymongo import monitoring
+from services.log import log_event
+from services.request_timing import command_collection
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _series_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """Counters, gauges and histograms shared by every worker on a host
+
+    Each process keeps its own values in memory. When ``directory`` is set, a
+    background thread writes them to ``<directory>/<pid>.json`` every
+    ``flush_seconds`` and ``render()`` sums the files of all workers, so any worker
+    can answer a scrape for the whole server. Counters and histograms of workers
+    that have exited are kept, their gauges are dropped. Clear the directory when
+    the server is restarted, as prometheus_client's multiprocess mode requires.
+
+    Without a directory each process reports only itself.
+    """
+
+    def __init__(self, directory=None, flush_seconds=5):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._meta = {}
+        self._buckets = {}
+        self._ratios = []
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        self._values = {}
+        self._histograms = {}
+
+    def _check_pid(self):
+        # Values inherited across a fork belong to the parent
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._reset()
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+                thread = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+                thread.start()
+                atexit.register(self.write)
+
+    def _declare(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def counter(self, name, help_text):
+        self._declare(name, 'counter', help_text)
+
+    def gauge(self, name, help_text):
+        self._declare(name, 'gauge', help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._declare(name, 'histogram', help_text)
+        self._buckets[name] = tuple(buckets)
+
+    def ratio(self, name, help_text, numerator, denominators):
+        """Gauge computed after aggregation as numerator / sum(denominators) per label set"""
+        self._declare(name, 'gauge', help_text)
+        self._ratios.append((name, numerator, tuple(denominators)))
+
+    def collector(self, fn):
+        """Register fn(registry) to refresh values sampled from live objects before each snapshot"""
+        self._collectors.append(fn)
+        return fn
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self._check_pid()
+            key = (name, _series_key(labels))
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._check_pid()
+            self._values[(name, _series_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        buckets = self._buckets[name]
+        with self._lock:
+            self._check_pid()
+            key = (name, _series_key(labels))
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        """This process's values in a JSON-serialisable form"""
+        for fn in self._collectors:
+            try:
+                fn(self)
+            except Exception as e:
+                log_event('metrics_collector_failed', logging.WARNING, exc_info=True, error=str(e))
+        with self._lock:
+            self._check_pid()
+            return {
+                'pid': self._pid,
+                'values': [[name, list(key), value] for (name, key), value in self._values.items()],
+                'histograms': [[name, list(key), series] for (name, key), series in self._histograms.items()]
+            }
+
+    def write(self):
+        """Publish this process's snapshot for the other workers"""
+        if not self.directory:
+            return
+        snapshot = self.snapshot()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, os.path.join(self.directory, f"{snapshot['pid']}.json"))
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.write()
+            except Exception as e:
+                log_event('metrics_flush_failed', logging.WARNING, error=str(e))
+
+    def _snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+        self.write()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # A worker is replacing its file or exited mid-write
+                continue
+        return snapshots
+
+    def collect(self):
+        """Sum every worker's snapshot into {name: {series key: value}} and histograms"""
+        values = {}
+        histograms = {}
+        own_pid = os.getpid()
+        for snapshot in self._snapshots():
+            alive = snapshot['pid'] == own_pid or _pid_alive(snapshot['pid'])
+            for name, key, value in snapshot['values']:
+                kind = self._meta.get(name, ('gauge',))[0]
+                if kind == 'gauge' and not alive:
+                    continue
+                series = values.setdefault(name, {})
+                key = tuple(tuple(pair) for pair in key)
+                series[key] = series.get(key, 0) + value
+            for name, key, counts in snapshot['histograms']:
+                series = histograms.setdefault(name, {})
+                key = tuple(tuple(pair) for pair in key)
+                if key in series:
+                    series[key] = [a + b for a, b in zip(series[key], counts)]
+                else:
+                    series[key] = list(counts)
+        for name, numerator, denominators in self._ratios:
+            ratios = values.setdefault(name, {})
+            for key, top in values.get(numerator, {}).items():
+                total = sum(values.get(denominator, {}).get(key, 0) for denominator in denominators)
+                ratios[key] = top / total if total else 0
+        return values, histograms
+
+    def render(self):
+        """Prometheus text exposition format for the whole server"""
+        values, histograms = self.collect()
+        lines = []
+        for name in sorted(self._meta):
+            kind, help_text = self._meta[name]
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'histogram':
+                buckets = self._buckets[name] + (math.inf,)
+                for key, series in sorted(histograms.get(name, {}).items()):
+                    for i, bound in enumerate(buckets):
+                        # Finite buckets are already cumulative; +Inf is the total count
+                        count = series[i] if bound != math.inf else series[-1]
+                        lines.append(f'{name}_bucket{_format_labels(key, [("le", _format_value(bound))])} {count}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {_format_value(series[-2])}')
+                    lines.append(f'{name}_count{_format_labels(key)} {series[-1]}')
+            else:
+                for key, value in sorted(values.get(name, {}).items()):
+                    lines.append(f'{name}{_format_labels(key)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Count MongoDB commands and their duration by collection"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._inflight = {}
+        self._lock = threading.Lock()
+        registry.counter('attendmax_mongo_commands_total', 'MongoDB commands issued')
+        registry.counter('attendmax_mongo_command_failures_total', 'MongoDB commands that failed')
+        registry.counter('attendmax_mongo_command_seconds_total', 'Time spent in MongoDB commands')
+
+    def started(self, event):
+        collection = command_collection(event)
+        with self._lock:
+            self._inflight[(event.connection_id, event.request_id)] = (event.command_name, collection)
+        self.registry.inc('attendmax_mongo_commands_total', command=event.command_name, collection=collection)
+
+    def _finished(self, event):
+        with self._lock:
+            command, collection = self._inflight.pop(
+                (event.connection_id, event.request_id), (event.command_name, '')
+            )
+        self.registry.inc(
+            'attendmax_mongo_command_seconds_total', event.duration_micros / 1e6,
+            command=command, collection=collection
+        )
+        return command, collection
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        command, collection = self._finished(event)
+        self.registry.inc('attendmax_mongo_command_failures_total', command=command, collection=collection)
+
+
+class RequestMetrics:
+    """Latency histograms, request counts and in-flight gauges per route"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        registry.histogram('attendmax_request_duration_seconds', 'Request latency by route')
+        registry.counter('attendmax_requests_total', 'Requests served by route and status')
+        registry.gauge('attendmax_requests_in_flight', 'Requests currently being served by route')
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish)
+
+    def _route(self):
+        # Endpoint names without the blueprint prefix: login, mark_attendance, ...
+        return request.endpoint.rsplit('.', 1)[-1] if request.endpoint else 'unmatched'
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+        self.registry.inc('attendmax_requests_in_flight', route=self._route())
+
+    def _record_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _finish(self, exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        route = self._route()
+        status = 500 if exc is not None else g.pop('metrics_status', 500)
+        self.registry.inc('attendmax_requests_in_flight', -1, route=route)
+        self.registry.inc('attendmax_requests_total', route=route, status=str(status))
+        self.registry.observe('attendmax_request_duration_seconds', time.perf_counter() - started, route=route)
@@ -0,0 +1,118 @@
+"""
+Password hashing for AttendMax
+
+PBKDF2 verification is CPU bound, so it runs on a dedicated process pool instead of
+the request thread. The pool admits a bounded number of pending jobs and rejects the
+rest immediately so a login storm degrades into fast 503s rather than a stalled worker.
+"""
+import atexit
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+# Hash parameters for new and upgraded hashes in Werkzeug's method syntax; short forms
+# such as pbkdf2:sha256 or scrypt are expanded to their defaults
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+# Every server worker process has its own pool, so by default the host's cores are split
+# between them (WEB_CONCURRENCY is the worker count Gunicorn also reads)
+HASH_WORKERS = int(os.environ.get(
+    'HASH_WORKERS', max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1)))
+))
+HASH_QUEUE_SIZE = int(os.environ.get('HASH_QUEUE_SIZE', 64))
+HASH_TIMEOUT_SECONDS = float(os.environ.get('HASH_TIMEOUT_SECONDS', 10))
+
+
+class HashPoolBusy(Exception):
+    """Raised when the hashing pool is saturated or a job outlives its timeout"""
+
+
+class HashPool:
+    """Bounded process pool for password hashing and verification"""
+
+    def __init__(self, workers=HASH_WORKERS, queue_size=HASH_QUEUE_SIZE, timeout=HASH_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.pending = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # Forking would copy locks held by the logging, metrics and write buffer
+                # threads into the children; forkserver starts them from a clean process
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('forkserver')
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def run(self, fn, *args):
+        """Run fn(*args) on the pool and wait for the result"""
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashPoolBusy('Password hashing queue is full')
+        with self._lock:
+            self.pending += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HashPoolBusy('Password hashing timed out')
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+hash_pool = HashPool()
+atexit.register(hash_pool.shutdown)
+
+
+def hash_password(password):
+    """Hash a password with the configured parameters"""
+    return hash_pool.run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    """Check a password against a stored hash off the request thread"""
+    return hash_pool.run(check_password_hash, password_hash, password)
+
+
+@functools.lru_cache(maxsize=None)
+def _method_prefix(method):
+    # Werkzeug stores the method with its defaults filled in (pbkdf2:sha256 ->
+    # pbkdf2:sha256:600000); expand it the same way rather than running the KDF
+    name, *args = method.split(':')
+    if name == 'pbkdf2' and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    if name == 'scrypt' and not args:
+        return f'scrypt:{2 ** 15}:8:1'
+    return method
+
+
+def needs_rehash(password_hash):
+    """Return True if a stored hash was made with different parameters than configured"""
+    return password_hash.split('$', 1)[0] != _method_prefix(PASSWORD_HASH_METHOD)
@@ -0,0 +1,98 @@
+"""
+Signed, self-verifying QR code payloads
+
+A QR token carries the subject code, session id, teacher id and expiry, followed by
+an HMAC over those fields, so mark_attendance can validate a scan without reading
+the database and a student cannot extend or forge the expiry.
+"""
+import base64
+import datetime
+import hashlib
+import hmac
+import time
+from services.cache import PeriodicRefresh
+
+TOKEN_VERSION = 'A1'
+# A truncated 128-bit MAC keeps the QR code small while remaining unforgeable
+MAC_BYTES = 16
+
+
+class InvalidQRCode(Exception):
+    """Raised for malformed or tampered QR tokens"""
+
+
+class ExpiredQRCode(InvalidQRCode):
+    """Raised for correctly signed QR tokens past their expiry"""
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _mac(secret, message):
+    return hmac.new(secret.encode(), message.encode(), hashlib.sha256).digest()[:MAC_BYTES]
+
+
+def sign_qr_token(secret, subject_code, session_id, teacher_id, expires_at):
+    """Build a QR token; expires_at is a Unix timestamp in seconds"""
+    fields = '|'.join([subject_code, str(session_id), str(teacher_id), str(int(expires_at))])
+    body = f"{TOKEN_VERSION}.{_b64encode(fields.encode())}"
+    return f"{body}.{_b64encode(_mac(secret, body))}"
+
+
+def verify_qr_token(secret, token, now=None):
+    """Check a QR token's signature and expiry and return its claims"""
+    try:
+        version, encoded_fields, encoded_mac = token.split('.')
+        body = f"{version}.{encoded_fields}"
+        valid = version == TOKEN_VERSION and hmac.compare_digest(_b64decode(encoded_mac), _mac(secret, body))
+    except (ValueError, AttributeError):
+        raise InvalidQRCode('Invalid QR code format')
+    if not valid:
+        raise InvalidQRCode('Invalid QR code signature')
+
+    subject_code, session_id, teacher_id, expires_at = _b64decode(encoded_fields).decode().split('|')
+    expires_at = int(expires_at)
+    if (time.time() if now is None else now) > expires_at:
+        raise ExpiredQRCode('QR code has expired')
+
+    return {
+        'subject_code': subject_code,
+        'session_id': session_id,
+        'teacher_id': teacher_id,
+        'expires_at': expires_at
+    }
+
+
+class ClosedSessionList:
+    """In-memory set of QR sessions a teacher closed before their expiry
+
+    Refreshed from the database every ``refresh_seconds``; only sessions that are
+    closed but not yet expired need to be tracked, so the set stays tiny.
+    """
+
+    def __init__(self, collection, refresh_seconds=5):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self._closed = frozenset()
+        self._refresh = PeriodicRefresh(self.refresh, refresh_seconds)
+
+    def refresh(self):
+        """Reload closed, unexpired session ids from the database"""
+        cursor = self.collection.find(
+            {'is_active': False, 'closed_at': {'$exists': True}, 'expires_at': {'$gt': datetime.datetime.utcnow()}},
+            {'_id': 1}
+        )
+        self._closed = frozenset(str(doc['_id']) for doc in cursor)
+
+    def is_closed(self, session_id):
+        self._refresh.maybe_run()
+        return session_id in self._closed
+
+    def close(self, session_id):
+        """Record a local close immediately; other workers see it on their next refresh"""
+        self._closed = self._closed | {str(session_id)}
@@ -0,0 +1,112 @@
+"""
+Per-request MongoDB round-trip accounting and Server-Timing headers
+"""
+import logging
+import time
+from flask import g, has_app_context, request
+from pymongo import monitoring
+from services.log import log_event
+
+BUDGET_MODES = ('off', 'log', 'raise')
+
+
+class RoundTripBudgetExceeded(Exception):
+    """An endpoint issued more MongoDB commands than its budget allows"""
+
+
+class RequestStats:
+    """MongoDB commands issued while serving one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.commands = []
+        self.db_seconds = 0.0
+
+    @property
+    def count(self):
+        return len(self.commands)
+
+
+class RequestCommandListener(monitoring.CommandListener):
+    """Attribute each MongoDB command to the Flask request on the same thread
+
+    PyMongo publishes command events synchronously on the thread that issued the
+    command, so ``flask.g`` identifies the request. Commands from background
+    threads (write buffer flushes, change stream relays) have no request and are
+    ignored.
+    """
+
+    def _stats(self):
+        if has_app_context():
+            return g.get('db_stats')
+        return None
+
+    def started(self, event):
+        stats = self._stats()
+        if stats is not None:
+            stats.commands.append((event.command_name, command_collection(event)))
+
+    def succeeded(self, event):
+        stats = self._stats()
+        if stats is not None:
+            stats.db_seconds += event.duration_micros / 1e6
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+def command_collection(event):
+    """Collection a command targets, or '' for database-level commands"""
+    target = event.command.get(event.command_name)
+    return target if isinstance(target, str) else ''
+
+
+class RequestTiming:
+    """Add Server-Timing headers and enforce per-endpoint round-trip budgets
+
+    ``budgets`` maps endpoint names (``'api.mark_attendance'``) to the most MongoDB
+    commands one request may issue, cache fills and periodic refreshes included.
+    In ``log`` mode an overrun is logged; in ``raise`` mode it raises
+    RoundTripBudgetExceeded so test clients fail loudly. Commands issued while a
+    streamed response body is generated happen after the headers are sent and are
+    not counted.
+    """
+
+    def __init__(self, budgets=None, mode='log'):
+        if mode not in BUDGET_MODES:
+            raise ValueError(f"Budget mode must be one of {', '.join(BUDGET_MODES)}")
+        self.listener = RequestCommandListener()
+        self.budgets = dict(budgets or {})
+        self.mode = mode
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        g.db_stats = RequestStats()
+
+    def _finish(self, response):
+        stats = g.pop('db_stats', None)
+        if stats is None:
+            return response
+        total_ms = (time.perf_counter() - stats.started) * 1000
+        db_ms = stats.db_seconds * 1000
+        response.headers['Server-Timing'] = (
+            f'db;dur={db_ms:.2f};desc="{stats.count} commands", app;dur={max(total_ms - db_ms, 0):.2f}'
+        )
+        self.check_budget(request.endpoint, stats)
+        return response
+
+    def check_budget(self, endpoint, stats):
+        budget = self.budgets.get(endpoint)
+        if self.mode == 'off' or budget is None or stats.count <= budget:
+            return
+        commands = ', '.join(f'{name}:{collection}' if collection else name for name, collection in stats.commands)
+        message = f"{endpoint} issued {stats.count} MongoDB commands (budget {budget}): {commands}"
+        if self.mode == 'raise':
+            raise RoundTripBudgetExceeded(message)
+        log_event(
+            'db_budget_exceeded', logging.WARNING,
+            endpoint=endpoint, commands=stats.count, budget=budget, command_list=commands
+        )
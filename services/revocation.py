@@ -0,0 +1,81 @@
+"""
+Token revocation list for stateless JWT authentication
+"""
+import datetime
+from services.cache import PeriodicRefresh
+
+
+class RevocationList:
+    """In-memory view of the revoked_tokens collection, refreshed periodically
+
+    Documents are either ``{'jti': ..., 'expires_at': ...}`` for a single token or
+    ``{'user_id': ..., 'issued_before': ..., 'expires_at': ...}`` to revoke every
+    token a user was issued up to a cutoff second (password reset, role change, lockout).
+    """
+
+    def __init__(self, collection, refresh_seconds=30):
+        self.collection = collection
+        self.refresh_seconds = refresh_seconds
+        self._jtis = frozenset()
+        self._user_cutoffs = {}
+        self._refresh = PeriodicRefresh(self.refresh, refresh_seconds)
+
+    def refresh(self):
+        """Reload the revocation set from the database"""
+        now = datetime.datetime.utcnow()
+        jtis = set()
+        user_cutoffs = {}
+        cursor = self.collection.find(
+            {'expires_at': {'$gt': now}},
+            {'_id': 0, 'jti': 1, 'user_id': 1, 'issued_before': 1}
+        )
+        for doc in cursor:
+            if doc.get('jti'):
+                jtis.add(doc['jti'])
+            elif doc.get('user_id') and doc.get('issued_before'):
+                user_id = str(doc['user_id'])
+                cutoff = doc['issued_before']
+                if user_id not in user_cutoffs or cutoff > user_cutoffs[user_id]:
+                    user_cutoffs[user_id] = cutoff
+        self._jtis = frozenset(jtis)
+        self._user_cutoffs = user_cutoffs
+
+    def is_revoked(self, payload):
+        """Check decoded JWT claims against the revocation set"""
+        self._refresh.maybe_run()
+        jti = payload.get('jti')
+        if jti and jti in self._jtis:
+            return True
+        cutoff = self._user_cutoffs.get(str(payload.get('user_id')))
+        if cutoff is not None:
+            issued_at = datetime.datetime.utcfromtimestamp(payload.get('iat', 0))
+            # The cutoff is whole seconds like iat, so tokens from its own second are revoked too
+            return issued_at <= cutoff
+        return False
+
+    def revoke_token(self, payload):
+        """Revoke a single token by its jti until it would have expired anyway"""
+        expires_at = datetime.datetime.utcfromtimestamp(payload['exp'])
+        self.collection.update_one(
+            {'jti': payload['jti']},
+            {'$set': {
+                'jti': payload['jti'],
+                'user_id': payload.get('user_id'),
+                'expires_at': expires_at,
+                'revoked_at': datetime.datetime.utcnow()
+            }},
+            upsert=True
+        )
+        self._jtis = self._jtis | {payload['jti']}
+
+    def revoke_user(self, user_id, token_lifetime):
+        """Revoke every token issued to user_id up to now"""
+        now = datetime.datetime.utcnow()
+        issued_before = now.replace(microsecond=0)
+        self.collection.insert_one({
+            'user_id': str(user_id),
+            'issued_before': issued_before,
+            'expires_at': now + token_lifetime,
+            'revoked_at': now
+        })
+        self._user_cutoffs = {**self._user_cutoffs, str(user_id): issued_before}
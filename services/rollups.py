@@ -0,0 +1,232 @@
+"""
+Per-student, per-subject, per-month attendance rollups
+"""
+import calendar
+import datetime
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+
+def month_of(date):
+    """'2025-09-14' -> '2025-09'"""
+    return date[:7]
+
+
+def split_range(start_date, end_date):
+    """Split a YYYY-MM-DD range into whole months and the partial spans at either end
+
+    Returns ((first_month, last_month) or None, [(span_start, span_end), ...]).
+    """
+    start = datetime.date.fromisoformat(start_date)
+    end = datetime.date.fromisoformat(end_date)
+    first = start if start.day == 1 else (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    last = end.replace(day=calendar.monthrange(end.year, end.month)[1])
+    if last != end:
+        last = end.replace(day=1) - datetime.timedelta(days=1)
+    if first > last:
+        return None, [(start_date, end_date)] if start <= end else []
+    spans = []
+    if start < first:
+        spans.append((start_date, (first - datetime.timedelta(days=1)).isoformat()))
+    if last < end:
+        spans.append(((last + datetime.timedelta(days=1)).isoformat(), end_date))
+    return (first.isoformat()[:7], last.isoformat()[:7]), spans
+
+
+class AttendanceRollups:
+    """Present/total counters in attendance_rollups keyed by (student_id, subject_code, month)
+
+    ``total`` counts the class days a student was expected at. A student's first
+    record for a day (a scan, a synced scan or a teacher's entry) adds to it; when a
+    teacher closes a class session, every enrolled student with no record for that
+    day is counted absent, once per subject and day. Whether a day's absences were
+    counted is kept on its attendance_counters document, so a record arriving
+    afterwards turns the absence into a presence instead of adding a class day.
+
+    Changes are applied right after the attendance records they describe, in the
+    same request, so a summary read after a scan already includes it. A request
+    that fails between the two writes leaves the rollup behind; ``rebuild``
+    recomputes rollups from attendance_records to repair such drift.
+    """
+
+    def __init__(self, collection, records, counters, students):
+        self.collection = collection
+        self.records = records
+        self.counters = counters
+        self.students = students
+
+    def change(self, student_id, subject_code, date, status, previous, absences_counted):
+        """The $inc for a record moving from ``previous`` (None if new) to ``status``, or None"""
+        present = (status == 'present') - (previous == 'present')
+        # A new record adds a class day unless the student was already counted absent
+        total = 1 if previous is None and not absences_counted else 0
+        if not present and not total:
+            return None
+        return UpdateOne(
+            {'student_id': student_id, 'subject_code': subject_code, 'month': month_of(date)},
+            {
+                '$inc': {'present': present, 'total': total},
+                '$set': {'updated_at': datetime.datetime.utcnow()}
+            },
+            upsert=True
+        )
+
+    def record_changes(self, changes):
+        """Apply record changes, each (student_id, subject_code, date, status, previous, absences_counted)"""
+        operations = [operation for operation in (self.change(*change) for change in changes) if operation]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def record_change(self, student_id, subject_code, date, status, previous, absences_counted):
+        """Apply one record change"""
+        return self.record_changes([(student_id, subject_code, date, status, previous, absences_counted)])
+
+    def count_absences(self, subject_code, date):
+        """Count enrolled students with no record for a class day as absent, at most once per day"""
+        now = datetime.datetime.utcnow()
+        try:
+            result = self.counters.update_one(
+                {'subject_code': subject_code, 'date': date, 'absences_counted': {'$ne': True}},
+                {'$set': {'absences_counted': True, 'absences_counted_at': now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The counter exists and is already flagged
+            return 0
+        if not result.modified_count and result.upserted_id is None:
+            return 0
+
+        recorded = set(self.records.distinct('student_id', {'subject_code': subject_code, 'date': date}))
+        absent = [
+            student['_id']
+            for student in self.students.find({'subjects': subject_code}, {'_id': 1})
+            if student['_id'] not in recorded
+        ]
+        if absent:
+            self.collection.bulk_write([
+                UpdateOne(
+                    {'student_id': student_id, 'subject_code': subject_code, 'month': month_of(date)},
+                    {'$inc': {'present': 0, 'total': 1}, '$set': {'updated_at': now}},
+                    upsert=True
+                )
+                for student_id in absent
+            ], ordered=False)
+        return len(absent)
+
+    def summaries(self, student_id, start_month=None, end_month=None):
+        """Per-subject {'_id': subject_code, 'present': n, 'total': n} over a month range"""
+        query = {'student_id': student_id}
+        if start_month or end_month:
+            query['month'] = {}
+            if start_month:
+                query['month']['$gte'] = start_month
+            if end_month:
+                query['month']['$lte'] = end_month
+        totals = {}
+        for rollup in self.collection.find(query, {'_id': 0, 'subject_code': 1, 'present': 1, 'total': 1}):
+            group = totals.setdefault(rollup['subject_code'], {'_id': rollup['subject_code'], 'present': 0, 'total': 0})
+            group['present'] += rollup.get('present', 0)
+            group['total'] += rollup.get('total', 0)
+        return list(totals.values())
+
+    def range_summaries(self, student_id, subject_codes, start_date, end_date):
+        """Per-subject summaries for exactly a date range
+
+        Whole months inside the range come from rollups; the partial months at
+        either end are counted from attendance_records and the days whose absences
+        were counted, the same way the rollups count them.
+        """
+        months, spans = split_range(start_date, end_date)
+        totals = {}
+        if months:
+            for group in self.summaries(student_id, *months):
+                totals[group['_id']] = group
+        if spans:
+            in_spans = [{'date': {'$gte': span_start, '$lte': span_end}} for span_start, span_end in spans]
+            days = {}
+            for record in self.records.find(
+                {'student_id': student_id, '$or': in_spans}, {'_id': 0, 'subject_code': 1, 'date': 1, 'status': 1}
+            ):
+                days.setdefault(record['subject_code'], {})[record['date']] = record['status'] == 'present'
+            for counter in self.counters.find(
+                {'subject_code': {'$in': list(subject_codes)}, 'absences_counted': True, '$or': in_spans},
+                {'_id': 0, 'subject_code': 1, 'date': 1}
+            ):
+                days.setdefault(counter['subject_code'], {}).setdefault(counter['date'], False)
+            for subject_code, marks in days.items():
+                group = totals.setdefault(subject_code, {'_id': subject_code, 'present': 0, 'total': 0})
+                group['present'] += sum(marks.values())
+                group['total'] += len(marks)
+        return list(totals.values())
+
+    def rebuild(self, start_month=None, end_month=None, batch_size=1000):
+        """Recompute rollups for a month range from attendance_records; returns documents written"""
+        date_range = {}
+        if start_month:
+            date_range['$gte'] = f'{start_month}-01'
+        if end_month:
+            date_range['$lte'] = f'{end_month}-31'
+        match = {'date': date_range} if date_range else {}
+
+        # Days whose absences were counted add a class day for every enrolled student
+        counted_days = {}
+        counted_keys = []
+        for counter in self.counters.find(dict(match, absences_counted=True), {'subject_code': 1, 'date': 1}):
+            key = (counter['subject_code'], month_of(counter['date']))
+            counted_days[key] = counted_days.get(key, 0) + 1
+            counted_keys.append(f"{counter['subject_code']}|{counter['date']}")
+
+        rollups = {}
+        for group in self.records.aggregate([
+            {'$match': match},
+            {'$group': {
+                '_id': {
+                    'student_id': '$student_id',
+                    'subject_code': '$subject_code',
+                    'month': {'$substr': ['$date', 0, 7]}
+                },
+                'present': {'$sum': {'$cond': [{'$eq': ['$status', 'present']}, 1, 0]}},
+                # Records on counted days are already covered by the counted class days
+                'uncounted': {'$sum': {'$cond': [
+                    {'$in': [{'$concat': ['$subject_code', '|', '$date']}, counted_keys]}, 0, 1
+                ]}}
+            }}
+        ], allowDiskUse=True):
+            key = (group['_id']['student_id'], group['_id']['subject_code'], group['_id']['month'])
+            rollups[key] = {'present': group['present'], 'total': group['uncounted']}
+
+        subjects_counted = {subject_code for subject_code, _ in counted_days}
+        for student in self.students.find({'subjects': {'$in': list(subjects_counted)}}, {'subjects': 1}):
+            for (subject_code, month), days in counted_days.items():
+                if subject_code in student['subjects']:
+                    rollup = rollups.setdefault((student['_id'], subject_code, month), {'present': 0, 'total': 0})
+                    rollup['total'] += days
+
+        month_query = {}
+        if start_month:
+            month_query['$gte'] = start_month
+        if end_month:
+            month_query['$lte'] = end_month
+        self.collection.delete_many({'month': month_query} if month_query else {})
+
+        now = datetime.datetime.utcnow()
+        batch = []
+        written = 0
+        for (student_id, subject_code, month), counts in rollups.items():
+            batch.append({
+                'student_id': student_id,
+                'subject_code': subject_code,
+                'month': month,
+                'present': counts['present'],
+                'total': counts['total'],
+                'updated_at': now
+            })
+            if len(batch) >= batch_size:
+                self.collection.insert_many(batch, ordered=False)
+                written += len(batch)
+                batch = []
+        if batch:
+            self.collection.insert_many(batch, ordered=False)
+            written += len(batch)
+        return written
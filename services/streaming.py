@@ -0,0 +1,91 @@
+"""
+Keyset pagination and incremental JSON responses
+"""
+import base64
+import json
+from flask import Response, current_app, stream_with_context
+
+STREAM_BATCH_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+
+class InvalidCursor(ValueError):
+    """Raised for a pagination cursor that cannot be decoded"""
+
+
+def encode_cursor(*values):
+    """Pack the sort key of the last item on a page into an opaque token"""
+    raw = json.dumps([str(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(token, size):
+    """Unpack a token made by encode_cursor into its string values"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        raise InvalidCursor('Invalid pagination cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor('Invalid pagination cursor')
+    return values
+
+
+def parse_limit(value):
+    """Parse a page size query parameter, clamping it to MAX_PAGE_SIZE"""
+    if value is None:
+        return None
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+class KeysetPage:
+    """Yield at most ``limit`` documents from a sorted cursor and remember where the page ended
+
+    ``key`` maps a document to the values of its sort key; after iteration ``next``
+    holds the cursor token for the following page, or None on the last page.
+    """
+
+    def __init__(self, cursor, limit, key):
+        self.cursor = cursor.limit(limit + 1) if limit else cursor
+        self.limit = limit
+        self.key = key
+        self.last = None
+        self.has_more = False
+
+    def __iter__(self):
+        for count, document in enumerate(self.cursor):
+            if self.limit and count == self.limit:
+                self.has_more = True
+                break
+            self.last = document
+            yield document
+
+    @property
+    def next(self):
+        return encode_cursor(*self.key(self.last)) if self.has_more else None
+
+
+def stream_json_response(head, key, items, tail=None):
+    """Stream ``{**head, key: [items...], **tail()}`` without holding the list in memory
+
+    ``items`` is any iterable (typically a mapped pymongo cursor); each element is
+    serialized with the app's JSON provider as it is produced. ``tail`` is called
+    once the items are exhausted, so it can report values such as the next cursor.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        opening = dumps(head)
+        yield (opening[:-1] + ', ' if head else '{') + dumps(key) + ': ['
+        first = True
+        for item in items:
+            yield ('' if first else ', ') + dumps(item)
+            first = False
+        yield ']'
+        for name, value in (tail() if tail else {}).items():
+            yield ', ' + dumps(name) + ': ' + dumps(value)
+        yield '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,77 @@
+"""
+Background write coalescing for bookkeeping updates
+"""
+import atexit
+import logging
+import os
+import threading
+from services.log import log_event
+
+FLUSH_INTERVAL_MS = int(os.environ.get('WRITE_BUFFER_FLUSH_MS', 200))
+MAX_BATCH = int(os.environ.get('WRITE_BUFFER_MAX_BATCH', 500))
+
+
+class WriteBuffer:
+    """Queue write operations for a collection and apply them with one bulk_write
+
+    Operations are flushed by a background thread every ``flush_interval_ms`` or as
+    soon as ``max_batch`` are pending, and once more at interpreter shutdown. Ops
+    added with the same ``key`` replace each other while still pending, so a burst
+    of updates to one document costs a single write.
+    """
+
+    def __init__(self, collection, flush_interval_ms=FLUSH_INTERVAL_MS, max_batch=MAX_BATCH):
+        self.collection = collection
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.flushed = 0
+        self.errors = 0
+        self._pending = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def _ensure_thread(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='write-buffer', daemon=True)
+            self._thread.start()
+
+    def add(self, operation, key=None):
+        """Queue a pymongo write operation (UpdateOne, InsertOne, ...)"""
+        with self._lock:
+            self._ensure_thread()
+            if key is None:
+                self._seq += 1
+                key = ('_seq', self._seq)
+            self._pending[key] = operation
+            if len(self._pending) >= self.max_batch:
+                self._wakeup.set()
+
+    def flush(self):
+        """Apply every pending operation now"""
+        with self._lock:
+            batch = list(self._pending.values())
+            self._pending = {}
+        if not batch:
+            return 0
+        try:
+            self.collection.bulk_write(batch, ordered=False)
+            self.flushed += len(batch)
+        except Exception as e:
+            self.errors += 1
+            log_event('write_buffer_flush_failed', logging.ERROR, writes=len(batch), error=str(e))
+        return len(batch)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)